@@ -1,23 +1,43 @@
 #! /usr/bin/env python
 
+import asyncio
+import json
 import os
-import uuid
 
-from flask import (Flask, Response, make_response, redirect, render_template,
-                   request, send_from_directory, session, url_for)
+from flask import (Flask, Response, jsonify, make_response, redirect,
+                   render_template, request, send_from_directory, session,
+                   stream_template, stream_with_context, url_for)
 from flask_wtf.csrf import CSRFProtect
 from logzero import logger
 
+from applib.asyncaws import (create_folder_async, delete_file_async,
+                             delete_folder_async,
+                             get_temporary_credentials_async,
+                             list_bucket_page_async, run_sync)
 # Enforces permissions at each route.
 from applib.authorization import authorize
 from applib.aws import (create_bucket_folder, delete_file_from_bucket,
-                        delete_folder_from_bucket, get_aws_credentials)
-from applib.bucket import list_bucket_objects, resource_to_bucket_path
-# Performs authentication; maps attributes to normalized ID token.
-from applib.cas import authenticate, sso_logout
+                        delete_folder_from_bucket, delete_folder_tree,
+                        get_credentials_version, get_temporary_credentials,
+                        make_credentials_version, unpack_credentials)
+from applib.bucket import (InvalidCursor, list_bucket_page,
+                           resource_to_bucket_path)
+from applib.bulk import run_bulk_action
+from applib.cache import listing_cache
+from applib.downloads import get_download_plan
 from applib.permissions import (create_folder, download_file, has_permission,
                                 remove_file, remove_folder, upload_file)
-from applib.utils import init_flask_app, make_path_components
+from applib.prefetch import prefetch_child_folders, prefetch_stats
+from applib.search import search_bucket
+from applib.streaming import (choose_encoding, get_stream_min_rows,
+                              make_streamed_response)
+from applib.tables import query_table
+from applib.timing import timed, timed_await
+from applib.uploads import (abort_multipart_upload, complete_multipart_upload,
+                            create_multipart_upload, record_upload,
+                            sign_upload_parts)
+from applib.utils import (get_template_digest, init_flask_app,
+                          make_listing_etag, make_path_components)
 
 app = Flask(__name__)
 
@@ -61,11 +81,21 @@ def __browse_GET(subpath):
     # Remove trailing slash from subpath.
     if subpath.endswith("/"):
         subpath = subpath[:-1]
-    bucket_name = os.environ.get("S3_BUCKET")
     logger.info("subpath: {}".format(subpath))
-    objects = list_bucket_objects(subpath)
+    # Only the first page is rendered; the page fetches the rest from
+    # `listing` using the cursor.
+    with timed("list"):
+        objects = list_bucket_page(subpath)
+    with timed("sts"):
+        appconfig_version, _ = get_credentials_version()
+    return __render_browse(subpath, objects, appconfig_version)
+
+
+def __render_browse(subpath, objects, appconfig_version):
+    bucket_name = os.environ.get("S3_BUCKET")
     path_components = make_path_components(subpath)
     bucket_path = resource_to_bucket_path(subpath)
+    folder_path = bucket_path
     if bucket_path.endswith("/"):
         bucket_path = bucket_path[:-1]
     allow_download_file = has_permission(download_file)
@@ -73,43 +103,101 @@ def __browse_GET(subpath):
     allow_remove_file = has_permission(remove_file)
     allow_remove_folder = has_permission(remove_folder)
     allow_create_folder = has_permission(create_folder)
-    appconfig_version = str(uuid.uuid4())
-    return render_template(
-        "browse.jinja2",
+    # Large pages are streamed, compressed, as they are rendered.
+    rows = len(objects["files"]) + len(objects["folders"])
+    stream = rows >= get_stream_min_rows()
+    encoding = choose_encoding() if stream else None
+    # The page only changes with the listing, the user's permissions and
+    # credentials, and the templates.
+    etag = make_listing_etag(
+        objects,
+        bucket_name,
+        subpath,
+        session["identity"]["sub"],
+        [
+            allow_download_file,
+            allow_upload_file,
+            allow_remove_file,
+            allow_remove_folder,
+            allow_create_folder,
+        ],
+        str(appconfig_version),
+        os.environ.get("FRIENDLY_BUCKET"),
+        get_template_digest(app, "base.jinja2", "browse.jinja2"),
+        encoding,
+    )
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    # Warm the listings of the folders the user is likely to open next.
+    prefetch_child_folders(bucket_name, folder_path, objects["folders"])
+    context = dict(
         appconfig_version=appconfig_version,
         friendly_bucket=os.environ.get("FRIENDLY_BUCKET"),
         bucket_name=bucket_name,
         bucket_objects=objects,
+        listing_cursor=objects["cursor"],
         path_components=path_components,
         subpath=subpath,
         bucket_path=bucket_path,
+        # Built once per page rather than once per row.
+        folder_base=url_for("browse", subpath=subpath) + "/",
+        key_prefix=bucket_path + "/" if bucket_path else "",
         allow_download_file=allow_download_file,
         allow_upload_file=allow_upload_file,
         allow_remove_file=allow_remove_file,
         allow_remove_folder=allow_remove_folder,
         allow_create_folder=allow_create_folder,
     )
+    if stream:
+        resp = make_streamed_response(
+            stream_template("browse.jinja2", **context), encoding
+        )
+    else:
+        with timed("render"):
+            resp = make_response(render_template("browse.jinja2", **context))
+    resp.set_etag(etag)
+    # Revalidate on every visit; unchanged folders are answered with 304.
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 
 def __browse_DELETE(subpath):
     logger.debug("__browse_DELETE; subpath: `{}`".format(subpath))
+    key, error = __check_delete(subpath)
+    if error is not None:
+        return error
+    if not key.endswith("/"):
+        return delete_file_from_bucket(key)
+    if request.args.get("recursive") == "true":
+        return json_result(delete_folder_tree(key))
+    return delete_folder_from_bucket(key)
+
+
+def __check_delete(subpath):
+    """
+    Return the bucket key to delete for `subpath` and an error response if
+    the user may not delete it.
+    """
     allow_remove_file = has_permission(remove_file)
     allow_remove_folder = has_permission(remove_folder)
     if not (allow_remove_file or allow_remove_folder):
-        return "Forbidden", 403
+        return None, ("Forbidden", 403)
     key = resource_to_bucket_path(subpath, force_endslash=False)
     is_folder = key.endswith("/")
     is_file = not is_folder
     if not allow_remove_folder and is_folder:
-        return "Forbidden", 403
+        return key, ("Forbidden", 403)
     if not allow_remove_file and is_file:
-        return "Forbidden", 403
+        return key, ("Forbidden", 403)
+    # Removing a tree removes its files, too.
+    if is_folder and request.args.get("recursive") == "true":
+        if not allow_remove_file:
+            return key, ("Forbidden", 403)
     logger.debug("bucket path: {}".format(key))
-    if is_file:
-        return delete_file_from_bucket(key)
-    if is_folder:
-        return delete_folder_from_bucket(key)
-    return "Bad Request", 400
+    return key, None
 
 
 def __browse_PUT(subpath):
@@ -118,25 +206,221 @@ def __browse_PUT(subpath):
     return create_bucket_folder(key)
 
 
+@app.route("/listing/<path:subpath>")
+@authorize()
+def listing(subpath):
+    """
+    Return one page of the folder listing at `subpath` as JSON.
+    Pass the returned `cursor` back as a query parameter to get the next page.
+    """
+    if subpath.endswith("/"):
+        subpath = subpath[:-1]
+    cursor = request.args.get("cursor")
+    try:
+        objects = list_bucket_page(subpath, cursor=cursor)
+    except InvalidCursor as ex:
+        logger.warning("Invalid listing cursor for `{}`: {}".format(subpath, ex))
+        return "Bad Request", 400
+    return jsonify(objects)
+
+
+@app.route("/table/<kind>/<path:subpath>")
+@authorize()
+def table(kind, subpath):
+    """
+    Server-side processing for the `files` or `folders` table of the folder
+    at `subpath`, following the DataTables protocol: `start`, `length`,
+    `search[value]` (a substring of the name) and `order[0][column]` /
+    `order[0][dir]` select a page of rows.
+    """
+    if kind not in ("files", "folders"):
+        return "Not Found", 404
+    if subpath.endswith("/"):
+        subpath = subpath[:-1]
+    try:
+        result = query_table(subpath, kind, request.args)
+    except ValueError as ex:
+        logger.warning("Invalid table request for `{}`: {}".format(subpath, ex))
+        return "Bad Request", 400
+    resp = jsonify(result)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@app.route("/search/<path:subpath>")
+@authorize()
+def search(subpath):
+    """
+    Search the files below `subpath` for the query parameter `q` (a
+    substring or a glob).  Results are streamed as newline-delimited JSON,
+    one file per line, followed by a summary line with `"done": true`.
+    An optional `limit` lowers the maximum number of results.
+    """
+    if subpath.endswith("/"):
+        subpath = subpath[:-1]
+    query = request.args.get("q", "").strip()
+    if query == "":
+        return "Bad Request", 400
+    try:
+        limit = int(request.args.get("limit", "0")) or None
+    except ValueError:
+        return "Bad Request", 400
+    results = search_bucket(subpath, query, max_results=limit)
+    lines = (json.dumps(result) + "\n" for result in results)
+    resp = Response(stream_with_context(lines), mimetype="application/x-ndjson")
+    resp.headers["Cache-Control"] = "no-store"
+    # Ask proxies not to buffer the stream.
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def json_result(result):
+    """
+    Return `result` as a JSON response unless it is already a
+    (message, status) error response.
+    """
+    if isinstance(result, tuple):
+        return result
+    return jsonify(result)
+
+
+@app.route("/download")
+@authorize()
+def download():
+    """
+    Return a presigned download URL and range plan for the bucket `key`
+    given as a query parameter.
+    """
+    if not has_permission(download_file):
+        return "Forbidden", 403
+    key = request.args.get("key")
+    resp = json_result(get_download_plan(key))
+    if not isinstance(resp, tuple):
+        resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@app.route("/uploads/<action>", methods=["POST"])
+@authorize()
+def uploads(action):
+    """
+    Multipart upload sessions.  The JSON request body has the bucket `key`
+    and, except for `create`, the `upload_id`:
+
+    * `create` - start an upload; optional `size` in bytes.
+    * `sign` - presign upload URLs for `part_numbers`.
+    * `complete` - assemble the uploaded parts.
+    * `abort` - discard the upload.
+    * `uploaded` - record a file uploaded with a single PutObject request;
+      no `upload_id`.
+    """
+    if not has_permission(upload_file):
+        return "Forbidden", 403
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        return "Bad Request", 400
+    key = params.get("key")
+    upload_id = params.get("upload_id")
+    if action not in ("create", "uploaded") and (
+        not isinstance(upload_id, str) or upload_id == ""
+    ):
+        return "Bad Request", 400
+    if action == "create":
+        size = params.get("size")
+        if size is not None and (not isinstance(size, int) or size < 0):
+            return "Bad Request", 400
+        return json_result(create_multipart_upload(key, size=size))
+    if action == "sign":
+        part_numbers = params.get("part_numbers")
+        if not isinstance(part_numbers, list):
+            return "Bad Request", 400
+        return json_result(sign_upload_parts(key, upload_id, part_numbers))
+    if action == "complete":
+        return json_result(complete_multipart_upload(key, upload_id))
+    if action == "abort":
+        return abort_multipart_upload(key, upload_id)
+    if action == "uploaded":
+        return json_result(record_upload(key))
+    return "Not Found", 404
+
+
+@app.route("/bulk/<action>", methods=["POST"])
+@authorize()
+def bulk(action):
+    """
+    Delete, copy or move many files in one request.  The JSON request body
+    has the bucket `keys` of the files and, for `copy` and `move`, the
+    `destination` folder:
+
+    * `delete` - requires the `remove_file` permission.
+    * `copy` - requires `upload_file`.
+    * `move` - requires `upload_file` and `remove_file`.
+
+    Results are reported per key.
+    """
+    required = {
+        "delete": [remove_file],
+        "copy": [upload_file],
+        "move": [upload_file, remove_file],
+    }.get(action)
+    if required is None:
+        return "Not Found", 404
+    if not all(has_permission(perm) for perm in required):
+        return "Forbidden", 403
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        return "Bad Request", 400
+    return json_result(
+        run_bulk_action(action, params.get("keys"), params.get("destination"))
+    )
+
+
+@app.route("/stats/listing-cache")
+@authorize()
+def listing_cache_stats():
+    """
+    Return listing cache hit/miss and prefetch counters as JSON.
+    """
+    return jsonify(dict(listing_cache.stats(), prefetch=prefetch_stats()))
+
+
 @app.route("/js/<uuid:version>.js")
 @authorize()
 def appconfig_js(version):
-    access_key_id, secret_access_key, session_token = get_aws_credentials()
-    resp = make_response(
-        render_template(
-            "appconfig.jinja2",
-            access_key_id=access_key_id,
-            secret_access_key=secret_access_key,
-            session_token=session_token,
-        ),
-        200,
-    )
+    with timed("sts"):
+        credentials = get_temporary_credentials()
+    return __render_appconfig(version, credentials)
+
+
+def __render_appconfig(version, credentials):
+    access_key_id, secret_access_key, session_token = unpack_credentials(credentials)
+    current_version, max_age = make_credentials_version(credentials)
+    with timed("render"):
+        resp = make_response(
+            render_template(
+                "appconfig.jinja2",
+                access_key_id=access_key_id,
+                secret_access_key=secret_access_key,
+                session_token=session_token,
+            ),
+            200,
+        )
     resp.headers["Content-Type"] = "application/javascript; charset=utf-8"
+    # The script is versioned by the credential generation, so the browser
+    # may reuse it until the credentials are about to expire.
+    if version == current_version and max_age > 0:
+        resp.headers["Cache-Control"] = "private, max-age={}".format(max_age)
+    else:
+        resp.headers["Cache-Control"] = "no-store"
     return resp
 
 
 @app.route("/login")
 def login():
+    # Performs authentication; maps attributes to normalized ID token.
+    # Imported on first use: `requests` and `lxml` are only needed to log in.
+    from applib.cas import authenticate
+
     return authenticate()
 
 
@@ -149,6 +433,8 @@ def logout():
     username = session["identity"]["sub"]
     logger.info("User `{}` was logged out.".format(username))
     session.clear()
+    from applib.cas import sso_logout
+
     return sso_logout()
 
 
@@ -156,3 +442,47 @@ def logout():
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template("404.jinja2"), 404
+
+
+async def browse_async(subpath):
+    """
+    Async `browse`: AWS calls do not block the worker, and the listing and
+    the credentials are fetched concurrently.
+    """
+    if request.method == "DELETE":
+        logger.debug("__browse_DELETE; subpath: `{}`".format(subpath))
+        key, error = __check_delete(subpath)
+        if error is not None:
+            return error
+        if not key.endswith("/"):
+            return await delete_file_async(key)
+        if request.args.get("recursive") == "true":
+            return json_result(await run_sync(delete_folder_tree, key))
+        return await delete_folder_async(key)
+    if request.method == "PUT":
+        key = resource_to_bucket_path(subpath)
+        logger.debug("New folder: {}".format(key))
+        return await create_folder_async(key)
+    if subpath.endswith("/"):
+        subpath = subpath[:-1]
+    logger.info("subpath: {}".format(subpath))
+    objects, credentials = await asyncio.gather(
+        timed_await("list", list_bucket_page_async(subpath)),
+        timed_await("sts", get_temporary_credentials_async()),
+    )
+    appconfig_version, _ = make_credentials_version(credentials)
+    return __render_browse(subpath, objects, appconfig_version)
+
+
+async def appconfig_js_async(version):
+    credentials = await timed_await("sts", get_temporary_credentials_async())
+    return __render_appconfig(version, credentials)
+
+
+def use_async_views():
+    """
+    Replace the blocking views that call AWS with their async versions.
+    Called by `asgi.py`; async views need `asgiref`.
+    """
+    app.view_functions["browse"] = authorize()(browse_async)
+    app.view_functions["appconfig_js"] = authorize()(appconfig_js_async)
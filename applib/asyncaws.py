@@ -0,0 +1,226 @@
+"""
+AWS calls for the async views, which replace the blocking views when the
+application is served by `asgi.py`.
+
+Calls are made with aiobotocore clients if aiobotocore is installed, and
+otherwise with the shared boto3 clients on a thread pool.  Either way a
+request does not hold the event loop while a call is in flight, so
+independent calls can be awaited together with `asyncio.gather()`.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logzero import logger
+
+from applib.aws import (check_file_key, check_folder_key,
+                        find_temporary_credentials,
+                        store_temporary_credentials)
+from applib.bucket import (find_folder_page, invalidate_listings,
+                           resource_to_bucket_path, store_folder_page,
+                           with_folder_totals)
+from applib.clients import get_client, get_client_options
+from applib.folderstats import (get_folder_stats_store, record_file_change,
+                                record_folder_created, record_folder_removed)
+
+_lock = threading.Lock()
+_executor = None
+# aiobotocore clients are bound to the event loop that created them.
+_loop_clients = {}
+
+
+def get_async_workers():
+    """
+    Return the number of threads that run blocking AWS calls when
+    aiobotocore is not used.
+    """
+    return max(1, int(os.environ.get("AWS_ASYNC_WORKERS", "32")))
+
+
+def use_aiobotocore():
+    """
+    Should AWS calls be made with aiobotocore?  `AWS_ASYNC_CLIENT` is `auto`
+    (if it is installed), `aiobotocore` or `threads`.
+    """
+    setting = os.environ.get("AWS_ASYNC_CLIENT", "auto").lower()
+    if setting == "threads":
+        return False
+    if setting == "aiobotocore":
+        return True
+    return importlib.util.find_spec("aiobotocore") is not None
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_async_workers(), thread_name_prefix="aws"
+            )
+    return _executor
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run the blocking `func` on the thread pool.  It sees the caller's
+    context, including the Flask request context.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+async def create_async_client(service_name):
+    # Optional dependency, imported on first use.
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+
+    logger.debug("Creating async `%s` client.", service_name)
+    config = AioConfig(**get_client_options())
+    context = get_session().create_client(service_name, config=config)
+    return await context.__aenter__()
+
+
+async def get_async_client(service_name):
+    """
+    Return the aiobotocore client for `service_name` of the running event
+    loop.  Clients are created once per loop and kept for the life of the
+    process.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _loop_clients.setdefault(loop, {})
+    future = clients.get(service_name)
+    if future is None:
+        # Concurrent callers wait for the same client.
+        future = loop.create_task(create_async_client(service_name))
+        clients[service_name] = future
+    try:
+        return await asyncio.shield(future)
+    except Exception:
+        if clients.get(service_name) is future:
+            del clients[service_name]
+        raise
+
+
+async def call_aws(service_name, operation, **params):
+    """
+    Call `operation` (e.g. `list_objects_v2`) of `service_name` and return
+    the response.  Errors are raised as `botocore.exceptions.ClientError`.
+    """
+    if use_aiobotocore():
+        client = await get_async_client(service_name)
+        return await getattr(client, operation)(**params)
+    client = get_client(service_name)
+    return await run_sync(getattr(client, operation), **params)
+
+
+async def list_bucket_page_async(path, cursor=None):
+    """
+    Async `applib.bucket.list_bucket_page()`.
+    """
+    bucket_name = os.environ.get("S3_BUCKET")
+    message = "You must provide the environment variable `S3_BUCKET`."
+    assert bucket_name, Exception(message)
+    bucket_path = resource_to_bucket_path(path)
+    objects, params = find_folder_page(bucket_name, bucket_path, cursor)
+    if objects is None:
+        started = time.perf_counter()
+        response = await call_aws("s3", "list_objects_v2", **params)
+        objects = store_folder_page(params, response, started)
+    return with_folder_totals(bucket_path, objects)
+
+
+async def get_temporary_credentials_async():
+    """
+    Async `applib.aws.get_temporary_credentials()`.
+    """
+    credentials, params = find_temporary_credentials()
+    if params is None:
+        return credentials
+    response = await call_aws("sts", "assume_role", **params)
+    return store_temporary_credentials(params, response["Credentials"])
+
+
+async def get_object_size_async(bucket_name, key):
+    """
+    Async `applib.folderstats.get_object_size()`.
+    """
+    if get_folder_stats_store() is None:
+        return None
+    from botocore.exceptions import ClientError
+
+    try:
+        resp = await call_aws("s3", "head_object", Bucket=bucket_name, Key=key)
+    except ClientError:
+        return None
+    return resp["ContentLength"]
+
+
+async def delete_file_async(key):
+    """
+    Async `applib.aws.delete_file_from_bucket()`.
+    """
+    error = check_file_key(key)
+    if error is not None:
+        return error
+    bucket_name = os.environ.get("S3_BUCKET")
+    logger.debug("Deleting bucket: %s, key: %s ...", bucket_name, key)
+    size = await get_object_size_async(bucket_name, key)
+    resp = await call_aws("s3", "delete_object", Bucket=bucket_name, Key=key)
+    invalidate_listings(bucket_name, key)
+    if size is not None:
+        record_file_change(key, -size, -1)
+    return "Response Status", resp["ResponseMetadata"]["HTTPStatusCode"]
+
+
+async def files_in_folder_async(bucket_name, folder):
+    """
+    Async `applib.aws.files_in_folder()`.
+    """
+    resp = await call_aws(
+        "s3",
+        "list_objects_v2",
+        Bucket=bucket_name,
+        Delimiter="/",
+        MaxKeys=2,
+        Prefix=folder,
+    )
+    return len(resp.get("Contents", [])) > 1
+
+
+async def delete_folder_async(key):
+    """
+    Async `applib.aws.delete_folder_from_bucket()`.
+    """
+    error = check_folder_key(key)
+    if error is not None:
+        return error
+    bucket_name = os.environ.get("S3_BUCKET")
+    if await files_in_folder_async(bucket_name, key):
+        return "Cannot delete folder containing files.", 403
+    logger.debug("Deleting bucket: %s, key: %s ...", bucket_name, key)
+    resp = await call_aws("s3", "delete_object", Bucket=bucket_name, Key=key)
+    invalidate_listings(bucket_name, key)
+    record_folder_removed(key)
+    return "Response Status", resp["ResponseMetadata"]["HTTPStatusCode"]
+
+
+async def create_folder_async(key):
+    """
+    Async `applib.aws.create_bucket_folder()`.
+    """
+    error = check_folder_key(key)
+    if error is not None:
+        return error
+    bucket_name = os.environ.get("S3_BUCKET")
+    resp = await call_aws("s3", "put_object", Bucket=bucket_name, Key=key)
+    invalidate_listings(bucket_name, key)
+    record_folder_created(key)
+    return "Response Status", resp["ResponseMetadata"]["HTTPStatusCode"]
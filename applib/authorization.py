@@ -1,58 +1,83 @@
+import inspect
 import json
 import os
+import time
 from functools import wraps
 
 from flask import redirect, render_template, request, session, url_for
 from logzero import logger
 
-from applib.permissions import list_files
+from applib.permissions import compact_identity, has_permission, list_files
+from applib.timing import record_phase
 
 
 def authorize():
     """
     Decorator for Flask routes.
     If a user is not authenticated or not authorized deny access to the resource.
+    Works for both plain and `async` views.
     """
 
     def decorator(f):
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def decorated_coroutine(*args, **kwargs):
+                resp = check_authorization()
+                if resp is not None:
+                    return resp
+                return await f(*args, **kwargs)
+
+            return decorated_coroutine
+
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            client_ip = request.headers.get("X-Forwarded-For") or request.remote_addr
-            if client_ip == "127.0.0.1":
-                dev_identity = os.environ.get("APP_DEV_IDENTITY")
-                if dev_identity:
-                    with open(dev_identity) as fname:
-                        try:
-                            session["identity"] = json.load(fname)
-                        except json.JSONDecodeError:
-                            message = (
-                                "Could not decode `APP_DEV_IDENTITY` "
-                                "environment variable."
-                            )
-                            logger.warn(message)
-                    logger.debug(session["identity"])
-            identity = session.get("identity")
-            if identity is None:
-                logger.debug(
-                    "Client IP {} is not authenticated. Redirecting to login endpoint.".format(
-                        client_ip
-                    )
-                )
-                return redirect(url_for("login"))
-            username = identity["sub"]
-            permissions = identity.get("permissions")
-            # Require `list_files` to use the application at all.
-            has_permissions = permissions[list_files]
-            if not has_permissions:
-                logger.debug("App identity: {}".format(identity))
-                logger.debug(
-                    "User `{}`, client IP {} is not authorized for resource `{}`.".format(
-                        username, client_ip, request.path
-                    )
-                )
-                return render_template("403.jinja2"), 403
+            resp = check_authorization()
+            if resp is not None:
+                return resp
             return f(*args, **kwargs)
 
         return decorated_function
 
     return decorator
+
+
+def check_authorization():
+    """
+    Return the response that denies access to the current request, or None
+    if the user may proceed.
+    """
+    started = time.perf_counter()
+    client_ip = request.headers.get("X-Forwarded-For") or request.remote_addr
+    if client_ip == "127.0.0.1":
+        dev_identity = os.environ.get("APP_DEV_IDENTITY")
+        if dev_identity:
+            with open(dev_identity) as fname:
+                try:
+                    session["identity"] = compact_identity(json.load(fname))
+                except json.JSONDecodeError:
+                    message = (
+                        "Could not decode `APP_DEV_IDENTITY` environment variable."
+                    )
+                    logger.warn(message)
+            logger.debug(session["identity"])
+    identity = session.get("identity")
+    if identity is None:
+        logger.debug(
+            "Client IP {} is not authenticated. Redirecting to login endpoint.".format(
+                client_ip
+            )
+        )
+        return redirect(url_for("login"))
+    username = identity["sub"]
+    # Require `list_files` to use the application at all.
+    if not has_permission(list_files):
+        logger.debug("App identity: {}".format(identity))
+        logger.debug(
+            "User `{}`, client IP {} is not authorized for resource `{}`.".format(
+                username, client_ip, request.path
+            )
+        )
+        return render_template("403.jinja2"), 403
+    record_phase("authorize", started)
+    return None
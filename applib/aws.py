@@ -1,39 +1,134 @@
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import unquote_plus
 
-import boto3
 from flask import session
 from logzero import logger
 
-from applib.permissions import download_file, has_permission, upload_file
+from applib.bucket import invalidate_listings, list_all_bucket_objects
+from applib.clients import get_client
+from applib.folderstats import (get_object_size, record_file_change,
+                                record_files_removed, record_folder_created,
+                                record_folder_removed)
+from applib.permissions import has_permission, upload_file
+from applib.websecurity import get_csrf_session_secret
 
+# Duration of assumed-role credentials.  900 seconds is the minimum.
+CREDENTIALS_DURATION = 900
 
-def get_aws_credentials():
+_credentials_lock = threading.Lock()
+_credentials_cache = {}
+
+
+def get_credentials_margin():
     """
-    Assume a dedicated role and return temporary credentials.
+    Return the number of seconds before expiry at which cached credentials
+    are no longer handed out.
+    """
+    return int(os.environ.get("AWS_CREDENTIALS_MARGIN", "120"))
+
+
+def get_policy_arns():
+    """
+    Return the session policy ARNs granted to the current user.
+    Downloads use presigned URLs (see `applib.downloads`) and do not need
+    temporary credentials.
     """
-    username = session["identity"]["sub"]
-    role_arn = get_arn_from_env("S3_ROLE_ARN")
     policy_arns = []
-    if has_permission(download_file):
-        download_policy_arn = get_arn_from_env("DOWNLOAD_POLICY_ARN")
-        policy_arns.append({"arn": download_policy_arn})
     if has_permission(upload_file):
         upload_policy_arn = get_arn_from_env("UPLOAD_POLICY_ARN")
         policy_arns.append({"arn": upload_policy_arn})
+    return policy_arns
+
+
+def get_temporary_credentials():
+    """
+    Return the temporary credentials of the current user, or None if the user
+    has no permissions that require them.
+    Credentials are cached per (user, policy ARN set) and reused until
+    `AWS_CREDENTIALS_MARGIN` seconds before they expire.
+    """
+    credentials, params = find_temporary_credentials()
+    if params is None:
+        return credentials
+    client = get_client("sts")
+    response = client.assume_role(**params)
+    return store_temporary_credentials(params, response["Credentials"])
+
+
+def find_temporary_credentials():
+    """
+    Look up the temporary credentials of the current user in the cache.
+    Returns (credentials, None) if they are cached or the user needs none,
+    or (None, params) with the `AssumeRole` parameters that issue them.
+    """
+    username = session["identity"]["sub"]
+    policy_arns = get_policy_arns()
     logger.debug(
         "Policy ARNs for temporary credentials for `{}`: {}.".format(
             username, policy_arns
         )
     )
-    if len(policy_arns) > 0:
-        client = boto3.client("sts")
-        response = client.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName=username,
-            DurationSeconds=900,  # Minimum duration
-            PolicyArns=policy_arns,
-        )
-        credentials = response["Credentials"]
+    if len(policy_arns) == 0:
+        return None, None
+    params = {
+        "RoleArn": get_arn_from_env("S3_ROLE_ARN"),
+        "RoleSessionName": username,
+        "DurationSeconds": CREDENTIALS_DURATION,
+        "PolicyArns": policy_arns,
+    }
+    now = time.time()
+    margin = get_credentials_margin()
+    with _credentials_lock:
+        credentials = _credentials_cache.get(get_credentials_cache_key(params))
+    if credentials is not None and credentials["Expiration"].timestamp() - margin > now:
+        logger.debug("Reusing cached credentials for `{}`.".format(username))
+        return credentials, None
+    return None, params
+
+
+def get_credentials_cache_key(params):
+    return (
+        params["RoleSessionName"],
+        tuple(sorted(p["arn"] for p in params["PolicyArns"])),
+    )
+
+
+def store_temporary_credentials(params, credentials):
+    """
+    Cache the credentials issued for the `AssumeRole` parameters `params`,
+    dropping expired entries.
+    """
+    now = time.time()
+    margin = get_credentials_margin()
+    with _credentials_lock:
+        expired = [
+            k
+            for k, v in _credentials_cache.items()
+            if v["Expiration"].timestamp() - margin <= now
+        ]
+        for k in expired:
+            del _credentials_cache[k]
+        _credentials_cache[get_credentials_cache_key(params)] = credentials
+    return credentials
+
+
+def get_aws_credentials():
+    """
+    Assume a dedicated role and return temporary credentials.
+    """
+    return unpack_credentials(get_temporary_credentials())
+
+
+def unpack_credentials(credentials):
+    """
+    Return the access key ID, secret access key and session token of
+    `credentials`, or placeholders if there are none.
+    """
+    if credentials is not None:
         access_key_id = credentials["AccessKeyId"]
         secret_access_key = credentials["SecretAccessKey"]
         session_token = credentials["SessionToken"]
@@ -44,6 +139,35 @@ def get_aws_credentials():
     return access_key_id, secret_access_key, session_token
 
 
+def get_credentials_version():
+    """
+    Return a UUID that identifies the current generation of the user's
+    temporary credentials, and the number of seconds the generation remains
+    valid.  The UUID changes whenever new credentials are issued, so it can
+    be used to version the cacheable `/js/<uuid>.js` configuration script.
+    """
+    return make_credentials_version(get_temporary_credentials())
+
+
+def make_credentials_version(credentials):
+    """
+    Return the UUID and remaining lifetime of the generation of the user's
+    `credentials`; see `get_credentials_version()`.  The script also embeds
+    the CSRF token, so the UUID changes with the session, too.
+    """
+    username = session["identity"]["sub"]
+    csrf_secret = get_csrf_session_secret()
+    if credentials is None:
+        name = "{}:no-credentials:{}:{}".format(
+            username, get_policy_arns(), csrf_secret
+        )
+        return uuid.uuid5(uuid.NAMESPACE_URL, name), 0
+    name = "{}:{}:{}".format(username, credentials["AccessKeyId"], csrf_secret)
+    expires = credentials["Expiration"].timestamp() - get_credentials_margin()
+    max_age = max(0, int(expires - time.time()))
+    return uuid.uuid5(uuid.NAMESPACE_URL, name), max_age
+
+
 def get_arn_from_env(symbol):
     """
     Return an ARN from and environment variable.
@@ -54,21 +178,51 @@ def get_arn_from_env(symbol):
     return arn
 
 
-def delete_file_from_bucket(key):
+def check_file_key(key):
     """
-    Delete a file from the S3 bucket.
+    Return an error response if `key` is not a file below `BUCKET_ROOT`,
+    else None.
     """
-    logger.debug("Entered delete_file_from_bucket().")
     if key.endswith("/"):
         return "Bad Request", 400
-    bucket_name = os.environ.get("S3_BUCKET")
     bucket_root = os.environ.get("BUCKET_ROOT", "")
     if not key.startswith(bucket_root):
         return "Forbidden", 403
+    return None
+
+
+def check_folder_key(key):
+    """
+    Return an error response if `key` is not a folder below `BUCKET_ROOT`,
+    else None.
+    """
+    if not key.endswith("/"):
+        return "Bad Request", 400
+    bucket_root = os.environ.get("BUCKET_ROOT", "")
+    if not key.startswith(bucket_root):
+        return "Forbidden", 403
+    if key == bucket_root:
+        return "Forbidden", 403
+    return None
+
+
+def delete_file_from_bucket(key):
+    """
+    Delete a file from the S3 bucket.
+    """
+    logger.debug("Entered delete_file_from_bucket().")
+    error = check_file_key(key)
+    if error is not None:
+        return error
+    bucket_name = os.environ.get("S3_BUCKET")
     logger.debug("Deleting bucket: {}, key: {} ...".format(bucket_name, key))
-    client = boto3.client("s3")
+    size = get_object_size(bucket_name, key)
+    client = get_client("s3")
     resp = client.delete_object(Bucket=bucket_name, Key=key)
     logger.debug("Response from deleting file: {}".format(resp))
+    invalidate_listings(bucket_name, key)
+    if size is not None:
+        record_file_change(key, -size, -1)
     meta = resp["ResponseMetadata"]
     http_status = meta["HTTPStatusCode"]
     return "Response Status", http_status
@@ -79,7 +233,7 @@ def files_in_folder(folder):
     Test if files exist in the folder.
     """
     bucket_name = os.environ.get("S3_BUCKET")
-    client = boto3.client("s3")
+    client = get_client("s3")
     resp = client.list_objects_v2(
         Bucket=bucket_name,
         Delimiter="/",
@@ -95,40 +249,163 @@ def delete_folder_from_bucket(key):
     Delete a folder from the S3 bucket.
     """
     logger.debug("Entered delete_folder_from_bucket().")
-    if not key.endswith("/"):
-        return "Bad Request", 400
+    error = check_folder_key(key)
+    if error is not None:
+        return error
     bucket_name = os.environ.get("S3_BUCKET")
-    bucket_root = os.environ.get("BUCKET_ROOT", "")
-    if not key.startswith(bucket_root):
-        return "Forbidden", 403
-    if key == bucket_root:
-        return "Forbidden", 403
     if files_in_folder(key):
         return "Cannot delete folder containing files.", 403
     logger.debug("Deleting bucket: {}, key: {} ...".format(bucket_name, key))
-    client = boto3.client("s3")
+    client = get_client("s3")
     resp = client.delete_object(Bucket=bucket_name, Key=key)
     logger.debug("Response from deleting file: {}".format(resp))
+    invalidate_listings(bucket_name, key)
+    record_folder_removed(key)
     meta = resp["ResponseMetadata"]
     http_status = meta["HTTPStatusCode"]
     return "Response Status", http_status
 
 
-def create_bucket_folder(key):
+def get_bucket_root_prefix():
     """
-    Create a bucket folder.
+    Return `BUCKET_ROOT` as a folder prefix (with a trailing slash), or an
+    empty string if the application may use the whole bucket.
+    """
+    bucket_root = os.environ.get("BUCKET_ROOT", "")
+    if bucket_root != "" and not bucket_root.endswith("/"):
+        bucket_root = bucket_root + "/"
+    return bucket_root
+
+
+# Maximum number of keys accepted by a single DeleteObjects request.
+DELETE_BATCH_SIZE = 1000
+
+
+def get_delete_concurrency():
+    """
+    Return the number of DeleteObjects batches kept in flight.
     """
+    return max(1, int(os.environ.get("DELETE_CONCURRENCY", "8")))
+
+
+def delete_key_batch(bucket_name, keys):
+    """
+    Delete up to 1000 keys with a single DeleteObjects request.
+    Returns (deleted_count, errors).
+    """
+    client = get_client("s3")
+    resp = client.delete_objects(
+        Bucket=bucket_name,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+    errors = [
+        {"key": err["Key"], "code": err.get("Code"), "message": err.get("Message")}
+        for err in resp.get("Errors", [])
+    ]
+    return len(keys) - len(errors), errors
+
+
+def generate_key_batches(bucket_name, prefix, sizes=None):
+    """
+    Generate lists of at most `DELETE_BATCH_SIZE` keys under `prefix`.  The
+    sizes of the keys are added to the dict `sizes`, if given.
+    """
+    batch = []
+    for item in list_all_bucket_objects(bucket_name, prefix):
+        key = unquote_plus(item["Key"])
+        if not key.startswith(prefix):
+            logger.warning("Skipping key `{}` outside `{}`.".format(key, prefix))
+            continue
+        if sizes is not None:
+            sizes[key] = item["Size"]
+        batch.append(key)
+        if len(batch) == DELETE_BATCH_SIZE:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def delete_folder_tree(key):
+    """
+    Delete a folder and everything below it from the S3 bucket.
+    Keys are deleted in DeleteObjects batches, several batches at a time.
+    Returns a report of the form:
+
+        {
+            "deleted": number of keys deleted,
+            "errors": [{"key": ..., "code": ..., "message": ...}, ...]
+        }
+    """
+    logger.debug("Entered delete_folder_tree().")
     if not key.endswith("/"):
         return "Bad Request", 400
     bucket_name = os.environ.get("S3_BUCKET")
-    bucket_root = os.environ.get("BUCKET_ROOT", "")
-    if not key.startswith(bucket_root):
+    root_prefix = get_bucket_root_prefix()
+    if not key.startswith(root_prefix):
         return "Forbidden", 403
-    if key == bucket_root:
+    if key == root_prefix:
         return "Forbidden", 403
-    client = boto3.client("s3")
+    concurrency = get_delete_concurrency()
+    deleted = 0
+    errors = []
+    # Keys of each pending batch, their sizes, and the keys deleted so far.
+    pending = {}
+    sizes = {}
+    removed = []
+
+    def collect(done):
+        nonlocal deleted
+        for future in done:
+            batch = pending.pop(future)
+            count, batch_errors = future.result()
+            deleted += count
+            errors.extend(batch_errors)
+            failed = {error["key"] for error in batch_errors}
+            removed.extend(k for k in batch if k not in failed)
+
+    logger.debug("Deleting bucket: {}, tree: {} ...".format(bucket_name, key))
+    completed = False
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch in generate_key_batches(bucket_name, key, sizes):
+                if len(pending) >= concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(delete_key_batch, bucket_name, batch)] = batch
+            done, _ = wait(pending)
+            collect(done)
+        completed = True
+    finally:
+        invalidate_listings(bucket_name, key)
+        if completed and len(errors) == 0:
+            record_folder_removed(key)
+        else:
+            # Only part of the tree is gone: subtract just the deleted files,
+            # including those of batches that finished after a failure.
+            collect([f for f in list(pending) if f.done() and not f.exception()])
+            record_files_removed(removed, sizes)
+    logger.info(
+        "Deleted tree `{}`: {} keys deleted, {} errors.".format(
+            key, deleted, len(errors)
+        )
+    )
+    return {"deleted": deleted, "errors": errors}
+
+
+def create_bucket_folder(key):
+    """
+    Create a bucket folder.
+    """
+    error = check_folder_key(key)
+    if error is not None:
+        return error
+    bucket_name = os.environ.get("S3_BUCKET")
+    client = get_client("s3")
     resp = client.put_object(Bucket=bucket_name, Key=key)
     logger.debug("Response from creating folder: {}".format(resp))
+    invalidate_listings(bucket_name, key)
+    record_folder_created(key)
     meta = resp["ResponseMetadata"]
     http_status = meta["HTTPStatusCode"]
     return "Response Status", http_status
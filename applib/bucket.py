@@ -1,9 +1,29 @@
+import logging
 import os
+import time
 from urllib.parse import unquote_plus
 
-import boto3
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
 from logzero import logger
 
+from applib.cache import listing_cache
+from applib.clients import get_client
+from applib.folderstats import annotate_folders
+from applib.inventory import get_listing_index, mark_index_dirty
+from applib.listing import EntryList
+from applib.logutil import get_key_sampler, log_event
+
+# Prefix of cursor tokens that continue a listing from the inventory index
+# rather than an S3 continuation token.
+INDEX_TOKEN_PREFIX = "index:"
+
+
+class InvalidCursor(Exception):
+    """
+    A listing cursor could not be decoded or does not match the listed path.
+    """
+
 
 def resource_to_bucket_path(path, force_endslash=True):
     """
@@ -24,9 +44,10 @@ def resource_to_bucket_path(path, force_endslash=True):
     else:
         bucket_path = "/".join([bucket_root, subpath])
     logger.debug(
-        "subpath: `{}`, bucket_root: `{}`, bucket_path: `{}`".format(
-            subpath, bucket_root, bucket_path
-        )
+        "subpath: `%s`, bucket_root: `%s`, bucket_path: `%s`",
+        subpath,
+        bucket_root,
+        bucket_path,
     )
     return bucket_path
 
@@ -37,13 +58,13 @@ def list_all_bucket_objects(bucket_name, prefix):
     """
     truncated = True
     kwargs = {}
-    client = boto3.client("s3")
+    client = get_client("s3")
     while truncated:
         response = client.list_objects_v2(
             Bucket=bucket_name, EncodingType="url", Prefix=prefix, **kwargs
         )
         key_count = response["KeyCount"]
-        logger.debug(f"Keys returned in this page: {key_count}")
+        logger.debug("Keys returned in this page: %d", key_count)
         contents = response.get("Contents", [])
         for item in contents:
             yield item
@@ -52,6 +73,151 @@ def list_all_bucket_objects(bucket_name, prefix):
             kwargs["ContinuationToken"] = response["NextContinuationToken"]
 
 
+def get_listing_page_size():
+    """
+    Return the maximum number of entries (files and folders) in a listing page.
+    """
+    page_size = int(os.environ.get("LISTING_PAGE_SIZE", "1000"))
+    return max(1, min(page_size, 1000))
+
+
+def get_cursor_serializer():
+    """
+    Return the serializer used to sign listing cursors.
+    """
+    return URLSafeSerializer(current_app.secret_key, salt="listing-cursor")
+
+
+def make_listing_cursor(bucket_path, continuation_token):
+    """
+    Wrap an S3 continuation token in an opaque, signed cursor bound to
+    `bucket_path`.
+    """
+    if continuation_token is None:
+        return None
+    serializer = get_cursor_serializer()
+    return serializer.dumps({"p": bucket_path, "t": continuation_token})
+
+
+def parse_listing_cursor(cursor, bucket_path):
+    """
+    Return the S3 continuation token wrapped by `cursor`.
+    """
+    serializer = get_cursor_serializer()
+    try:
+        payload = serializer.loads(cursor)
+    except BadSignature:
+        raise InvalidCursor("Listing cursor has an invalid signature.")
+    if payload.get("p") != bucket_path:
+        raise InvalidCursor("Listing cursor does not belong to this path.")
+    return payload["t"]
+
+
+def list_bucket_level(bucket_name, prefix):
+    """
+    Generate the pages of a one-level (delimited) listing of `prefix`.
+    Only the keys and common prefixes directly below `prefix` are returned,
+    so the cost depends on the size of the folder, not of the subtree.
+    """
+    truncated = True
+    kwargs = {}
+    client = get_client("s3")
+    while truncated:
+        response = client.list_objects_v2(
+            Bucket=bucket_name,
+            Delimiter="/",
+            EncodingType="url",
+            Prefix=prefix,
+            **kwargs,
+        )
+        key_count = response["KeyCount"]
+        logger.debug("Keys and prefixes returned in this page: %d", key_count)
+        yield response
+        truncated = response["IsTruncated"]
+        if truncated:
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def parse_listing_page(response, bucket_path):
+    """
+    Split a delimited listing page into (files, folders), as `EntryList`s.
+    Keys are decoded and made relative to `bucket_path`.
+    """
+    # Per-key debug output is sampled; see `applib.logutil`.
+    sampler = get_key_sampler()
+    bucket_path_len = len(bucket_path)
+    files = EntryList()
+    folders = EntryList()
+    for item in response.get("Contents", []):
+        key = unquote_plus(item["Key"])[bucket_path_len:]
+        if key == "":
+            # The folder placeholder object itself.
+            continue
+        if sampler is not None and sampler():
+            logger.debug("Found key `%s`.", key)
+        files.append(key, item["Size"], item["LastModified"])
+    for item in response.get("CommonPrefixes", []):
+        key = unquote_plus(item["Prefix"])[bucket_path_len:]
+        if sampler is not None and sampler():
+            logger.debug("Found folder `%s`.", key)
+        folders.append(key, 0, "")
+    return files, folders
+
+
+def log_listing_summary(bucket_path, files, folders, started, **fields):
+    """
+    Log counts, total size and duration of a listing instead of its entries.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    total_bytes = files.total_size()
+    duration_ms = (time.perf_counter() - started) * 1000.0
+    log_event(
+        logging.INFO,
+        "listing",
+        "Listed `%s`: %d files, %d folders, %d bytes in %.1f ms.",
+        bucket_path,
+        len(files),
+        len(folders),
+        total_bytes,
+        duration_ms,
+        bucket_path=bucket_path,
+        files=len(files),
+        folders=len(folders),
+        bytes=total_bytes,
+        duration_ms=round(duration_ms, 3),
+        **fields,
+    )
+
+
+def list_index_entries(index, bucket_path, after=None, limit=None):
+    """
+    List a folder from the inventory index.  Returns (files, folders, last)
+    where `last` is the name of the last entry, or None.
+    """
+    files = EntryList()
+    folders = EntryList()
+    last = None
+    for name, size, last_modified in index.list_folder(
+        bucket_path, after=after, limit=limit
+    ):
+        if name.endswith("/"):
+            folders.append(name, 0, "")
+        else:
+            files.append(name, size, last_modified)
+        last = name
+    return files, folders, last
+
+
+def invalidate_listings(bucket_name, key):
+    """
+    Drop cached listings affected by a change to `key` and stop answering
+    them from the inventory index.
+    """
+    listing_cache.invalidate_key(bucket_name, key)
+    mark_index_dirty(bucket_name, key)
+
+
 def list_bucket_objects(path):
     """
     List the bucket objects at `path`.
@@ -60,40 +226,167 @@ def list_bucket_objects(path):
     message = "You must provide the environment variable `S3_BUCKET`."
     assert bucket_name, Exception(message)
     bucket_path = resource_to_bucket_path(path)
-    files = []
-    folders = set([])
+    objects = list_folder(bucket_name, bucket_path)
+    return with_folder_totals(bucket_path, objects)
+
+
+def with_folder_totals(bucket_path, objects):
+    """
+    Return `objects` with the stored folder totals filled in.  Cached
+    listings are not modified, so the totals are always current.
+    """
+    folders = annotate_folders(bucket_path, objects["folders"])
+    if folders is objects["folders"]:
+        return objects
+    return dict(objects, folders=folders)
+
+
+def list_folder(bucket_name, bucket_path):
+    """
+    List the folder `bucket_path` from the inventory index, the listing
+    cache, or S3.
+    """
+    index = get_listing_index()
+    if index is not None and index.can_serve(bucket_name, bucket_path):
+        started = time.perf_counter()
+        files, folders, _ = list_index_entries(index, bucket_path)
+        log_listing_summary(bucket_path, files, folders, started, source="index")
+        return {"files": files, "folders": folders}
+    cache_key = (bucket_name, bucket_path)
+    objects = listing_cache.get(cache_key)
+    if objects is not None:
+        logger.debug("Listing cache hit for `%s`.", bucket_path)
+        return objects
+    started = time.perf_counter()
+    files = EntryList()
+    folders = EntryList()
+    logger.debug("bucket_path: `%s`", bucket_path)
+    for response in list_bucket_level(bucket_name, bucket_path):
+        page_files, page_folders = parse_listing_page(response, bucket_path)
+        files.extend(page_files)
+        folders.extend(page_folders)
+    # Keep folders sorted by name.
+    folders = folders.sorted_by_key()
     objects = {"files": files, "folders": folders}
-    bucket_path_len = len(bucket_path)
-    logger.debug(f"bucket_path: `{bucket_path}`")
-    for item in list_all_bucket_objects(bucket_name, bucket_path):
-        key = unquote_plus(item["Key"][bucket_path_len:])
-        logger.debug(f"Found key `{key}`.")
-        if key == "":
-            continue
-        last_modified = item["LastModified"]
-        size = item["Size"]
-        item = {"key": key, "last_modified": last_modified.isoformat(), "size": size}
-        if key.endswith("/"):
-            if "/" in key[:-1]:
-                logger.debug(f"Key `{key}` is a folder with one or more subfolders.")
-            else:
-                logger.debug(f"Key `{key}` is a folder.")
-                folders.add(key)
-        elif "/" in key:
-            parts = key.split("/")
-            folders.add("{}/".format(parts[0]))
-            logger.debug(
-                f"Key `{key}` is a file with embedded folders."
-                f"  Adding folder `{parts[0]}`."
-            )
-            # skip files in subfolders.
-            # Only include their topmost folder part.
-            continue
-        else:
-            files.append(item)
-    folders = list(folders)
-    folders.sort()
-    folders = [{"key": k, "last_modified": "", "size": 0} for k in folders]
-    objects["folders"] = folders
-    logger.info(objects)
+    log_listing_summary(bucket_path, files, folders, started)
+    listing_cache.put(cache_key, objects)
+    return objects
+
+
+def list_bucket_page(path, cursor=None):
+    """
+    List a single page of the bucket objects at `path`.
+    Returns the same structure as `list_bucket_objects()` plus a `cursor`
+    that fetches the next page, or None if this is the last page.
+    """
+    bucket_name = os.environ.get("S3_BUCKET")
+    message = "You must provide the environment variable `S3_BUCKET`."
+    assert bucket_name, Exception(message)
+    bucket_path = resource_to_bucket_path(path)
+    objects = list_folder_page(bucket_name, bucket_path, cursor)
+    return with_folder_totals(bucket_path, objects)
+
+
+def list_folder_page(bucket_name, bucket_path, cursor=None):
+    """
+    List a single page of the folder `bucket_path` from the inventory index,
+    the listing cache, or S3.
+    """
+    objects, params = find_folder_page(bucket_name, bucket_path, cursor)
+    if objects is not None:
+        return objects
+    started = time.perf_counter()
+    client = get_client("s3")
+    response = client.list_objects_v2(**params)
+    return store_folder_page(params, response, started)
+
+
+def find_folder_page(bucket_name, bucket_path, cursor=None):
+    """
+    Look up a page of the folder `bucket_path` in the inventory index and the
+    listing cache.  Returns (objects, None) if found, or (None, params) with
+    the `ListObjectsV2` parameters that fetch the page from S3.
+    """
+    token = None
+    if cursor is not None:
+        token = parse_listing_cursor(cursor, bucket_path)
+    if token is None or token.startswith(INDEX_TOKEN_PREFIX):
+        index = get_listing_index()
+        if index is not None and index.can_serve(bucket_name, bucket_path):
+            return list_index_page(index, bucket_path, token), None
+        if token is not None:
+            raise InvalidCursor("The listing index is no longer in use.")
+    params = {
+        "Bucket": bucket_name,
+        "Delimiter": "/",
+        "EncodingType": "url",
+        "MaxKeys": get_listing_page_size(),
+        "Prefix": bucket_path,
+    }
+    if token is not None:
+        params["ContinuationToken"] = token
+    objects = listing_cache.get(get_page_cache_key(bucket_name, bucket_path, token))
+    if objects is not None:
+        logger.debug("Listing cache hit for a page of `%s`.", bucket_path)
+        return objects, None
+    return None, params
+
+
+def get_page_cache_key(bucket_name, bucket_path, token=None):
+    return (bucket_name, bucket_path, "page", token)
+
+
+def store_folder_page(params, response, started):
+    """
+    Convert the `ListObjectsV2` response for `params` to a listing page and
+    add it to the listing cache.
+    """
+    bucket_path = params["Prefix"]
+    files, folders = parse_listing_page(response, bucket_path)
+    next_token = None
+    if response["IsTruncated"]:
+        next_token = response["NextContinuationToken"]
+    objects = {
+        "files": files,
+        "folders": folders,
+        "cursor": make_listing_cursor(bucket_path, next_token),
+    }
+    log_listing_summary(
+        bucket_path, files, folders, started, more=next_token is not None
+    )
+    cache_key = get_page_cache_key(
+        params["Bucket"], bucket_path, params.get("ContinuationToken")
+    )
+    listing_cache.put(cache_key, objects)
     return objects
+
+
+def list_index_page(index, bucket_path, token=None):
+    """
+    List a single page of the folder `bucket_path` from the inventory index.
+    Pages are keyed by the name of the last entry of the previous page.
+    """
+    started = time.perf_counter()
+    after = None
+    if token is not None:
+        after = token[len(INDEX_TOKEN_PREFIX) :]
+    page_size = get_listing_page_size()
+    files, folders, last = list_index_entries(
+        index, bucket_path, after=after, limit=page_size
+    )
+    next_token = None
+    if len(files) + len(folders) == page_size:
+        next_token = INDEX_TOKEN_PREFIX + last
+    log_listing_summary(
+        bucket_path,
+        files,
+        folders,
+        started,
+        more=next_token is not None,
+        source="index",
+    )
+    return {
+        "files": files,
+        "folders": folders,
+        "cursor": make_listing_cursor(bucket_path, next_token),
+    }
@@ -0,0 +1,353 @@
+"""
+Bulk operations on many files in one request.  Deletes are sent as batched
+DeleteObjects requests; copies (and moves, which copy and then delete) run
+as concurrent server-side CopyObject requests, with a multipart copy for
+objects larger than CopyObject accepts.
+"""
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from logzero import logger
+
+from applib.aws import (DELETE_BATCH_SIZE, delete_key_batch,
+                        get_bucket_root_prefix, get_delete_concurrency)
+from applib.bucket import invalidate_listings
+from applib.clients import get_client
+from applib.folderstats import (get_folder_stats_store, get_object_size,
+                                record_file_change)
+from applib.inventory import get_parent
+from applib.uploads import MAX_PARTS, MIN_PART_SIZE
+
+BULK_ACTIONS = ("delete", "copy", "move")
+# Largest object CopyObject can copy; larger ones are copied in parts.
+MAX_COPY_OBJECT_SIZE = 5 * 1024**3
+# Largest part of a multipart copy.
+MAX_COPY_PART_SIZE = 5 * 1024**3
+
+
+def get_bulk_max_keys():
+    """
+    Return the maximum number of keys accepted by one bulk request.
+    """
+    return max(1, int(os.environ.get("BULK_MAX_KEYS", "1000")))
+
+
+def get_copy_concurrency():
+    """
+    Return the number of objects copied at once.
+    """
+    return max(1, int(os.environ.get("COPY_CONCURRENCY", "8")))
+
+
+def get_copy_part_size(size):
+    """
+    Return the part size of a multipart copy of `size` bytes.
+    """
+    part_size = int(os.environ.get("COPY_PART_SIZE", str(512 * 1024**2)))
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+    return min(part_size, MAX_COPY_PART_SIZE)
+
+
+def is_valid_bulk_key(key):
+    """
+    Can `key` take part in a bulk operation?  Only files below `BUCKET_ROOT`
+    can.
+    """
+    if not isinstance(key, str) or key == "" or key.endswith("/"):
+        return False
+    return key.startswith(get_bucket_root_prefix())
+
+
+def is_valid_destination(folder):
+    """
+    Can files be copied into the folder `folder`?
+    """
+    if not isinstance(folder, str):
+        return False
+    root_prefix = get_bucket_root_prefix()
+    if folder == root_prefix:
+        return True
+    return folder.endswith("/") and folder.startswith(root_prefix)
+
+
+def make_error(key, code, message):
+    return {"key": key, "code": code, "message": message}
+
+
+def get_client_error(ex):
+    """
+    Return the (code, message) of a botocore `ClientError`.
+    """
+    error = ex.response.get("Error", {})
+    return error.get("Code"), error.get("Message")
+
+
+def invalidate_changed(bucket_name, keys):
+    """
+    Invalidate the listings of the folders that contain `keys`, once per
+    folder.
+    """
+    folders = {}
+    for key in keys:
+        folders.setdefault(get_parent(key), key)
+    for key in folders.values():
+        invalidate_listings(bucket_name, key)
+
+
+def get_object_sizes(bucket_name, keys):
+    """
+    Return the sizes of `keys` (None for missing keys) when folder totals are
+    on, else an empty dict.
+    """
+    if get_folder_stats_store() is None:
+        return {}
+    with ThreadPoolExecutor(max_workers=get_copy_concurrency()) as executor:
+        sizes = executor.map(lambda key: get_object_size(bucket_name, key), keys)
+        return dict(zip(keys, sizes))
+
+
+def delete_batch(bucket_name, keys):
+    """
+    Delete a batch of keys.  Returns the errors; if the request fails as a
+    whole, every key of the batch has an error.
+    """
+    client = get_client("s3")
+    try:
+        _, errors = delete_key_batch(bucket_name, keys)
+    except client.exceptions.ClientError as ex:
+        code, message = get_client_error(ex)
+        logger.warning(
+            "Could not delete a batch of {} keys: {}".format(len(keys), code)
+        )
+        return [make_error(key, code, message) for key in keys]
+    return errors
+
+
+def delete_keys(bucket_name, keys, sizes=None):
+    """
+    Delete `keys` in DeleteObjects batches, several batches at a time, and
+    update listings and folder totals.  `sizes` are the known sizes of the
+    keys.  Returns a dict of the errors by key.
+    """
+    if sizes is None:
+        sizes = get_object_sizes(bucket_name, keys)
+    batches = [
+        keys[n : n + DELETE_BATCH_SIZE] for n in range(0, len(keys), DELETE_BATCH_SIZE)
+    ]
+    workers = min(get_delete_concurrency(), len(batches))
+    errors = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_errors in executor.map(
+                lambda batch: delete_batch(bucket_name, batch), batches
+            ):
+                for error in batch_errors:
+                    errors[error["key"]] = error
+    finally:
+        invalidate_changed(bucket_name, keys)
+    for key in keys:
+        size = sizes.get(key)
+        if key not in errors and size is not None:
+            record_file_change(key, -size, -1)
+    return errors
+
+
+def copy_object_multipart(client, bucket_name, key, destination, head):
+    """
+    Copy `key` to `destination` with a multipart copy.  `head` is the
+    HeadObject response of `key`; its content type and metadata are kept.
+    """
+    size = head["ContentLength"]
+    part_size = get_copy_part_size(size)
+    params = {"Metadata": head.get("Metadata", {})}
+    if "ContentType" in head:
+        params["ContentType"] = head["ContentType"]
+    resp = client.create_multipart_upload(Bucket=bucket_name, Key=destination, **params)
+    upload_id = resp["UploadId"]
+    parts = []
+    try:
+        for part_number, start in enumerate(range(0, size, part_size), 1):
+            end = min(start + part_size, size) - 1
+            resp = client.upload_part_copy(
+                Bucket=bucket_name,
+                Key=destination,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                CopySource={"Bucket": bucket_name, "Key": key},
+                CopySourceRange="bytes={}-{}".format(start, end),
+            )
+            parts.append(
+                {"PartNumber": part_number, "ETag": resp["CopyPartResult"]["ETag"]}
+            )
+        client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=destination,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        client.abort_multipart_upload(
+            Bucket=bucket_name, Key=destination, UploadId=upload_id
+        )
+        raise
+    logger.info("Copied `{}` to `{}` in {} parts.".format(key, destination, len(parts)))
+
+
+def object_exists(client, bucket_name, key):
+    """
+    Does `key` exist?  Errors other than "not found" are raised.
+    """
+    try:
+        client.head_object(Bucket=bucket_name, Key=key)
+    except client.exceptions.ClientError as ex:
+        code, _ = get_client_error(ex)
+        if code in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def copy_file(bucket_name, key, destination):
+    """
+    Copy the file `key` to `destination` on the server side.  Existing files
+    are not replaced.  Returns (size, error).
+    """
+    client = get_client("s3")
+    try:
+        if object_exists(client, bucket_name, destination):
+            return None, make_error(
+                key, "DestinationExists", "A file with this name already exists."
+            )
+        head = client.head_object(Bucket=bucket_name, Key=key)
+        size = head["ContentLength"]
+        if size > MAX_COPY_OBJECT_SIZE:
+            copy_object_multipart(client, bucket_name, key, destination, head)
+        else:
+            client.copy_object(
+                Bucket=bucket_name,
+                Key=destination,
+                CopySource={"Bucket": bucket_name, "Key": key},
+            )
+    except client.exceptions.ClientError as ex:
+        code, message = get_client_error(ex)
+        logger.warning("Could not copy `{}`: {}".format(key, code))
+        return None, make_error(key, code, message)
+    return size, None
+
+
+def get_destination(key, folder):
+    """
+    Return the key of the copy of the file `key` in `folder`.
+    """
+    return folder + key.rsplit("/", 1)[-1]
+
+
+def copy_keys(bucket_name, keys, folder):
+    """
+    Copy `keys` into `folder`, several at a time, and update listings and
+    folder totals.  The names of `keys` must be distinct.  Returns
+    (destinations, sizes, errors) by key.
+    """
+    destinations = {key: get_destination(key, folder) for key in keys}
+    sizes = {}
+    errors = {}
+    workers = min(get_copy_concurrency(), len(keys))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                lambda key: copy_file(bucket_name, key, destinations[key]), keys
+            )
+            for key, (size, error) in zip(keys, results):
+                if error is not None:
+                    errors[key] = error
+                    continue
+                sizes[key] = size
+                record_file_change(destinations[key], size, 1)
+    finally:
+        invalidate_changed(bucket_name, destinations.values())
+    return destinations, sizes, errors
+
+
+def run_bulk_action(action, keys, destination=None):
+    """
+    Delete, copy or move the files `keys`; copies and moves go to the folder
+    `destination`.  Returns a report of the form:
+
+        {
+            "action": action,
+            "succeeded": number of keys,
+            "failed": number of keys,
+            "results": [
+                {"key": ..., "ok": true, "destination": ...},
+                {"key": ..., "ok": false, "code": ..., "message": ...},
+                ...
+            ]
+        }
+
+    Copies and moves report the `destination` key of each file.  Files are
+    not copied over existing files (`DestinationExists`), and only the
+    first of several files with the same name is copied.
+    """
+    if action not in BULK_ACTIONS:
+        return "Not Found", 404
+    if not isinstance(keys, list) or len(keys) == 0:
+        return "Bad Request", 400
+    if len(keys) > get_bulk_max_keys():
+        return "Request Entity Too Large", 413
+    if action != "delete" and not is_valid_destination(destination):
+        return "Bad Request", 400
+    bucket_name = os.environ.get("S3_BUCKET")
+    # Repeated keys are handled once.
+    keys = list(dict.fromkeys(key if isinstance(key, str) else None for key in keys))
+    errors = {}
+    valid_keys = []
+    # Destination keys already taken by an earlier key of this request.
+    claimed = set()
+    for key in keys:
+        if not is_valid_bulk_key(key):
+            errors[key] = make_error(key, "InvalidKey", "Not a file of this bucket.")
+        elif action != "delete" and get_parent(key) == destination:
+            errors[key] = make_error(
+                key, "InvalidDestination", "The file is already in this folder."
+            )
+        elif action != "delete" and get_destination(key, destination) in claimed:
+            errors[key] = make_error(
+                key,
+                "InvalidDestination",
+                "Another file of this request has the same name.",
+            )
+        else:
+            if action != "delete":
+                claimed.add(get_destination(key, destination))
+            valid_keys.append(key)
+    destinations = {}
+    if len(valid_keys) > 0:
+        if action == "delete":
+            errors.update(delete_keys(bucket_name, valid_keys))
+        else:
+            destinations, sizes, copy_errors = copy_keys(
+                bucket_name, valid_keys, destination
+            )
+            errors.update(copy_errors)
+            if action == "move":
+                copied = [key for key in valid_keys if key not in copy_errors]
+                if len(copied) > 0:
+                    errors.update(delete_keys(bucket_name, copied, sizes))
+    results = []
+    for key in keys:
+        if key in errors:
+            result = dict(errors[key], ok=False)
+        else:
+            result = {"key": key, "ok": True}
+        if key in destinations:
+            result["destination"] = destinations[key]
+        results.append(result)
+    logger.info("Bulk {} of {} keys: {} failed.".format(action, len(keys), len(errors)))
+    return {
+        "action": action,
+        "succeeded": len(keys) - len(errors),
+        "failed": len(errors),
+        "results": results,
+    }
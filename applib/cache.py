@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from logzero import logger
+
+
+class ListingCache:
+    """
+    Bounded, thread-safe cache of bucket listings with TTL and LRU eviction.
+
+    Keys are tuples that start with (bucket_name, bucket_path).  Additional
+    elements distinguish e.g. individual pages of the same folder.  All
+    entries for a folder are invalidated together.
+    """
+
+    def __init__(self, max_entries=256, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._folders = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key):
+        """
+        Return the cached value for `key` or None.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key):
+        """
+        Is there a current entry for `key`?  Does not count as a hit or miss.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def put(self, key, value):
+        """
+        Store `value` under `key`, evicting the least recently used entries
+        if the cache is full.
+        """
+        if not self.enabled:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (expires, value)
+            self._folders.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_folder(self, bucket_name, bucket_path):
+        """
+        Drop every cached entry for the folder `bucket_path`.
+        """
+        with self._lock:
+            keys = self._folders.pop((bucket_name, bucket_path), set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+        if len(keys) > 0:
+            logger.debug(
+                "Invalidated {} cached listing(s) for `{}`.".format(
+                    len(keys), bucket_path
+                )
+            )
+
+    def invalidate_key(self, bucket_name, key):
+        """
+        Drop the cached listings that a change to the object `key` can affect.
+        That is the folder itself (if `key` is a folder) and every folder
+        above it, because a folder that only exists through deeper keys
+        appears or disappears with them.
+        """
+        if key.endswith("/"):
+            self.invalidate_folder(bucket_name, key)
+        parts = key.rstrip("/").split("/")[:-1]
+        for n in range(len(parts), -1, -1):
+            folder = "".join(["{}/".format(part) for part in parts[:n]])
+            self.invalidate_folder(bucket_name, folder)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._folders.clear()
+
+    def stats(self):
+        """
+        Return cache counters.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        folder_keys = self._folders.get(key[:2])
+        if folder_keys is not None:
+            folder_keys.discard(key)
+            if len(folder_keys) == 0:
+                del self._folders[key[:2]]
+
+
+listing_cache = ListingCache(
+    max_entries=int(os.environ.get("LISTING_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("LISTING_CACHE_TTL", "30")),
+)
@@ -1,12 +1,17 @@
 import os
+import threading
 import urllib
 
 import requests
 from flask import abort, redirect, request, session, url_for
 from logzero import logger
 from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from applib.permissions import get_default_permissions
+from applib.permissions import compact_identity, get_default_permissions
+from applib.sessions import regenerate_session
+from applib.timing import timed
 
 
 def sso_logout():
@@ -28,14 +33,10 @@ def authenticate():
             "sub": usename of the authenticated principal.
             "family_name": family name of the principal,
             "given_name": given name of the principal,
-            "permissions": {
-                "list_files": boolean,
-                "create_folder": boolean,
-                "remove_folder": boolean,
-                "download_file": boolean,
-                "upload_file": boolean,
-                "remove_file": boolean,
-            }
+            "permissions": permission mask; see `permission_bits` in
+                `applib.permissions` for the bit of each of `list_files`,
+                `create_folder`, `remove_folder`, `download_file`,
+                `upload_file`, and `remove_file`.
         }
     """
     ticket = request.args.get("ticket", None)
@@ -55,7 +56,8 @@ def authenticate():
         return redirect(url)
     # Validate ticket
     logger.debug("Validating service ticket {}...".format(ticket[:10]))
-    is_valid, user, attributes = validate_service_ticket(ticket)
+    with timed("cas"):
+        is_valid, user, attributes = validate_service_ticket(ticket)
     if not is_valid:
         abort(401)
     # Success!  Log user in.
@@ -68,9 +70,11 @@ def authenticate():
         "permissions": get_default_permissions(),
     }
     logger.debug("Attributes from CAS: {}".format(attributes))
+    regenerate_session(session)
     session["identity"] = identity
     map_permissions(attributes)
     map_attributes(attributes)
+    compact_identity(identity)
     logger.debug("CAS authentication successful for '{}'.".format(user))
     session["username"] = user
     logger.debug("Application identity: {}".format(identity))
@@ -88,6 +92,62 @@ def make_service_url():
     return cas_service_url
 
 
+_http_session_lock = threading.Lock()
+_http_session = None
+
+
+def get_http_session():
+    """
+    Return the shared HTTP session used to talk to CAS.
+    Connections are kept alive and reused between logins.  Only failures to
+    connect are retried: a service ticket can be validated once, so a
+    request that reached CAS is not sent again.
+    """
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            max_retries = int(os.environ.get("CAS_MAX_RETRIES", "2"))
+            retries = Retry(
+                total=max_retries,
+                connect=max_retries,
+                read=0,
+                status=0,
+                backoff_factor=0.2,
+                allowed_methods=("GET",),
+            )
+            pool_size = int(os.environ.get("CAS_POOL_SIZE", "10"))
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size, max_retries=retries
+            )
+            http_session = requests.Session()
+            http_session.mount("https://", adapter)
+            http_session.mount("http://", adapter)
+            _http_session = http_session
+    return _http_session
+
+
+def get_cas_timeouts():
+    """
+    Return the (connect, read) timeouts in seconds for CAS requests.
+    """
+    connect_timeout = float(os.environ.get("CAS_CONNECT_TIMEOUT", "3.05"))
+    read_timeout = float(os.environ.get("CAS_READ_TIMEOUT", "10"))
+    return connect_timeout, read_timeout
+
+
+def parse_xml_response(response):
+    """
+    Parse an XML response body incrementally as it is received.
+    Returns the root element.
+    """
+    parser = etree.XMLPullParser(resolve_entities=False, no_network=True)
+    for chunk in response.iter_content(chunk_size=8192):
+        parser.feed(chunk)
+    return parser.close()
+
+
 def validate_service_ticket(ticket):
     """
     Validate a CAS service ticket.
@@ -103,14 +163,28 @@ def validate_service_ticket(ticket):
     service = make_service_url()
     params = dict(service=service, ticket=ticket)
     logger.debug("Validate URL: {}".format(cas_service_validate_url))
-    r = requests.get(cas_service_validate_url, params=params)
-    if not r.status_code == requests.codes.ok:
-        logger.debug(
-            "Validation request was unsuccessful: {} - {}".format(r.status_code, r.text)
-        )
+    http_session = get_http_session()
+    try:
+        with http_session.get(
+            cas_service_validate_url,
+            params=params,
+            timeout=get_cas_timeouts(),
+            stream=True,
+        ) as r:
+            if not r.status_code == requests.codes.ok:
+                logger.debug(
+                    "Validation request was unsuccessful: {} - {}".format(
+                        r.status_code, r.text
+                    )
+                )
+                return (False, None, None)
+            root = parse_xml_response(r)
+    except requests.RequestException as ex:
+        logger.warning("Could not validate service ticket: {}".format(ex))
+        return (False, None, None)
+    except etree.XMLSyntaxError as ex:
+        logger.warning("Could not parse CAS validation response: {}".format(ex))
         return (False, None, None)
-    parser = etree.XMLParser()
-    root = etree.fromstring(r.text, parser=parser)
     auth_result_elm = root[0]
     is_success = etree.QName(auth_result_elm).localname == "authenticationSuccess"
     if not is_success:
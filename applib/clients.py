@@ -0,0 +1,81 @@
+import os
+import threading
+
+from logzero import logger
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+def config2bool(s):
+    """
+    Convert an environment setting to a boolean value.
+    """
+    return s.strip().lower() in ("1", "t", "true", "y", "yes")
+
+
+def get_client_options():
+    """
+    Return the botocore configuration options shared by all clients.
+    """
+    return dict(
+        max_pool_connections=int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "25")),
+        tcp_keepalive=config2bool(os.environ.get("AWS_TCP_KEEPALIVE", "true")),
+        connect_timeout=float(os.environ.get("AWS_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.environ.get("AWS_READ_TIMEOUT", "30")),
+        retries={
+            "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "3")),
+            "mode": os.environ.get("AWS_RETRY_MODE", "standard"),
+        },
+    )
+
+
+def get_client_config():
+    """
+    Return the botocore configuration shared by all clients.
+    """
+    # boto3 and botocore are imported on first use to keep cold starts short.
+    from botocore.config import Config
+
+    return Config(**get_client_options())
+
+
+def get_client(service_name, region_name=None):
+    """
+    Return the process-wide client for `service_name`.
+    Clients are created once and reused so that their HTTP connection pools
+    (and TLS sessions) survive across requests.  boto3 clients are
+    thread-safe once created; creation is serialized here because boto3
+    sessions are not.
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    global _session
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            if _session is None:
+                import boto3
+
+                _session = boto3.session.Session()
+            logger.debug("Creating shared `{}` client.".format(service_name))
+            client = _session.client(
+                service_name,
+                region_name=region_name,
+                config=get_client_config(),
+            )
+            _clients[key] = client
+    return client
+
+
+def reset_clients():
+    """
+    Discard all shared clients.
+    """
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
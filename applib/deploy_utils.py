@@ -1,4 +1,4 @@
-import boto3
+from applib.clients import get_client
 
 
 def on_update(zappa_cli):
@@ -8,7 +8,7 @@ def on_update(zappa_cli):
     if zappa_cli.domain is None:
         return
     print("DOMAIN: `{}`".format(zappa_cli.domain))
-    client = boto3.client("apigateway")
+    client = get_client("apigateway")
     client.update_domain_name(
         domainName=zappa_cli.domain,
         patchOperations=[
@@ -0,0 +1,99 @@
+import math
+import os
+from urllib.parse import quote
+
+from logzero import logger
+
+from applib.aws import get_bucket_root_prefix
+from applib.clients import get_client
+
+
+def get_download_url_expiration():
+    """
+    Return the lifetime of presigned download URLs in seconds.
+    """
+    return int(os.environ.get("DOWNLOAD_URL_EXPIRES", "300"))
+
+
+def get_download_range_size():
+    """
+    Return the size in bytes of each range in a download range plan.
+    """
+    return int(os.environ.get("DOWNLOAD_RANGE_SIZE", str(64 * 1024 * 1024)))
+
+
+def make_range_plan(size, range_size):
+    """
+    Split an object of `size` bytes into inclusive byte ranges that can be
+    fetched in parallel with `Range: bytes=<start>-<end>` headers.
+    Objects no larger than `range_size` are fetched in one request.
+    """
+    if size <= range_size:
+        return []
+    ranges = []
+    for n in range(math.ceil(size / range_size)):
+        start = n * range_size
+        end = min(start + range_size, size) - 1
+        ranges.append({"start": start, "end": end})
+    return ranges
+
+
+def make_content_disposition(key):
+    """
+    Return a `Content-Disposition` header that saves the object under its
+    file name.
+    """
+    filename = key.rsplit("/", 1)[-1]
+    return "attachment; filename*=UTF-8''{}".format(quote(filename))
+
+
+def get_download_plan(key):
+    """
+    Return a short-lived presigned GET URL for `key` and a range plan for
+    fetching large objects as parallel byte ranges:
+
+        {
+            "key": bucket key,
+            "size": object size in bytes,
+            "etag": entity tag; send as `If-Match` with range requests,
+            "url": presigned URL,
+            "expires_in": URL lifetime in seconds,
+            "ranges": [{"start": first byte, "end": last byte}, ...]
+        }
+    """
+    if key is None or key == "" or key.endswith("/"):
+        return "Bad Request", 400
+    if not key.startswith(get_bucket_root_prefix()):
+        return "Forbidden", 403
+    bucket_name = os.environ.get("S3_BUCKET")
+    client = get_client("s3")
+    try:
+        head = client.head_object(Bucket=bucket_name, Key=key)
+    except client.exceptions.ClientError as ex:
+        code = ex.response.get("Error", {}).get("Code")
+        if code in ("404", "NoSuchKey"):
+            return "Not Found", 404
+        raise
+    size = head["ContentLength"]
+    expires = get_download_url_expiration()
+    url = client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": bucket_name,
+            "Key": key,
+            "ResponseContentDisposition": make_content_disposition(key),
+        },
+        ExpiresIn=expires,
+    )
+    ranges = make_range_plan(size, get_download_range_size())
+    logger.debug(
+        "Download plan for `{}`: {} bytes, {} ranges.".format(key, size, len(ranges))
+    )
+    return {
+        "key": key,
+        "size": size,
+        "etag": head.get("ETag"),
+        "url": url,
+        "expires_in": expires,
+        "ranges": ranges,
+    }
@@ -0,0 +1,399 @@
+#! /usr/bin/env python
+
+"""
+Per-folder totals: bytes, number of files, and newest modification of
+everything below a folder.
+
+Totals are computed once by listing the top-level folders of a prefix in
+parallel, stored in a SQLite database, and updated incrementally when this
+application creates or deletes objects.  Objects written by other clients are
+picked up by the next computation:
+
+    python -m applib.folderstats -s /path/to/stats.db [prefix]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+
+from logzero import logger
+
+from applib.clients import get_client
+from applib.listing import EntryList
+
+
+class FolderStatsStore:
+    """
+    Folder totals in a SQLite database, one row per folder path (with a
+    trailing slash).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS folder_stats"
+                " (path TEXT PRIMARY KEY, bytes INTEGER NOT NULL,"
+                " objects INTEGER NOT NULL, last_modified TEXT NOT NULL)"
+                " WITHOUT ROWID"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get_many(self, paths):
+        """
+        Return {path: (bytes, objects, last_modified)} for the known `paths`.
+        """
+        stats = {}
+        paths = list(paths)
+        with self._connect() as conn:
+            # Stay below SQLite's limit on query parameters.
+            for start in range(0, len(paths), 500):
+                chunk = paths[start : start + 500]
+                query = (
+                    "SELECT path, bytes, objects, last_modified FROM folder_stats"
+                    " WHERE path IN ({})".format(", ".join("?" * len(chunk)))
+                )
+                for path, size, objects, last_modified in conn.execute(query, chunk):
+                    stats[path] = (size, objects, last_modified)
+        return stats
+
+    def replace_subtree(self, prefix, totals):
+        """
+        Replace the rows of `prefix` and the folders below it with `totals`,
+        a mapping of path to (bytes, objects, last_modified).
+        """
+        with self._lock, self._connect() as conn:
+            delete_subtree(conn, prefix)
+            conn.executemany(
+                "INSERT INTO folder_stats VALUES (?, ?, ?, ?)",
+                [(path,) + tuple(row) for path, row in totals.items()],
+            )
+
+    def apply_delta(self, paths, size_delta, objects_delta, modified):
+        """
+        Add `size_delta` and `objects_delta` to each folder in `paths` and
+        move its newest modification forward to `modified`.
+        """
+        with self._lock, self._connect() as conn:
+            for path in paths:
+                conn.execute(
+                    "INSERT OR IGNORE INTO folder_stats VALUES (?, 0, 0, '')",
+                    (path,),
+                )
+                conn.execute(
+                    "UPDATE folder_stats"
+                    " SET bytes = max(bytes + ?, 0), objects = max(objects + ?, 0),"
+                    " last_modified = max(last_modified, ?) WHERE path = ?",
+                    (size_delta, objects_delta, modified, path),
+                )
+
+    def remove_subtree(self, prefix):
+        """
+        Remove the rows of `prefix` and the folders below it and return the
+        totals of `prefix` as (bytes, objects), or None if it was unknown.
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT bytes, objects FROM folder_stats WHERE path = ?", (prefix,)
+            ).fetchone()
+            delete_subtree(conn, prefix)
+        return row
+
+
+def delete_subtree(conn, prefix):
+    """
+    Delete the rows of the folder `prefix` and of the folders below it.
+    """
+    if prefix == "":
+        conn.execute("DELETE FROM folder_stats")
+        return
+    # Folder paths end with `/`; `0` is the next character.
+    conn.execute(
+        "DELETE FROM folder_stats WHERE path >= ? AND path < ?",
+        (prefix, prefix[:-1] + "0"),
+    )
+
+
+_stores_lock = threading.Lock()
+_stores = {}
+
+
+def get_folder_stats_store():
+    """
+    Return the store at `FOLDER_STATS_PATH`, or None if folder totals are off.
+    """
+    path = os.environ.get("FOLDER_STATS_PATH")
+    if not path:
+        return None
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = FolderStatsStore(path)
+            _stores[path] = store
+    return store
+
+
+def get_folder_chain(key, root_prefix):
+    """
+    Return the folders from the one containing `key` up to and including
+    `root_prefix`.
+    """
+    folders = []
+    folder = key[: key.rstrip("/").rfind("/") + 1]
+    while len(folder) >= len(root_prefix):
+        folders.append(folder)
+        if folder == "":
+            break
+        folder = folder[: folder[:-1].rfind("/") + 1]
+    return folders
+
+
+def get_root_prefix():
+    bucket_root = os.environ.get("BUCKET_ROOT", "")
+    if bucket_root != "" and not bucket_root.endswith("/"):
+        bucket_root = bucket_root + "/"
+    return bucket_root
+
+
+def now_isoformat():
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+
+def annotate_folders(bucket_path, folders):
+    """
+    Return a copy of the folder entries (an `EntryList`) of a listing of
+    `bucket_path` with their stored totals (`size`, `objects` and
+    `last_modified`).
+    """
+    store = get_folder_stats_store()
+    if store is None or not folders:
+        return folders
+    try:
+        stats = store.get_many(bucket_path + key for key in folders.keys)
+    except sqlite3.Error:
+        logger.exception("Could not read folder totals.")
+        return folders
+    annotated = EntryList()
+    for item in folders:
+        row = stats.get(bucket_path + item.key)
+        if row is None:
+            annotated.append(item.key, item.size, item.last_modified)
+            continue
+        size, objects, last_modified = row
+        annotated.append(item.key, size, last_modified, objects)
+    return annotated
+
+
+def record_file_change(key, size_delta, objects_delta):
+    """
+    Update the totals of the folders containing the file `key`.
+    """
+    store = get_folder_stats_store()
+    if store is None:
+        return
+    try:
+        store.apply_delta(
+            get_folder_chain(key, get_root_prefix()),
+            size_delta,
+            objects_delta,
+            now_isoformat(),
+        )
+    except sqlite3.Error:
+        logger.exception("Could not update folder totals for `{}`.".format(key))
+
+
+def record_files_removed(keys, sizes):
+    """
+    Subtract the deleted files `keys`, whose sizes are in the dict `sizes`,
+    from the totals of the folders containing them.  Folder keys are not
+    counted.
+    """
+    store = get_folder_stats_store()
+    if store is None:
+        return
+    # [a key, size, objects] removed from each folder that held files.
+    removed = {}
+    for key in keys:
+        if key.endswith("/"):
+            continue
+        totals = removed.setdefault(key[: key.rfind("/") + 1], [key, 0, 0])
+        totals[1] += sizes.get(key, 0)
+        totals[2] += 1
+    root_prefix = get_root_prefix()
+    try:
+        for key, size, objects in removed.values():
+            store.apply_delta(
+                get_folder_chain(key, root_prefix), -size, -objects, now_isoformat()
+            )
+    except sqlite3.Error:
+        logger.exception("Could not update folder totals for deleted files.")
+
+
+def record_folder_created(key):
+    """
+    Start totals for the new folder `key`.
+    """
+    store = get_folder_stats_store()
+    if store is None:
+        return
+    try:
+        store.apply_delta(
+            [key] + get_folder_chain(key, get_root_prefix()), 0, 0, now_isoformat()
+        )
+    except sqlite3.Error:
+        logger.exception("Could not update folder totals for `{}`.".format(key))
+
+
+def record_folder_removed(key):
+    """
+    Drop the totals of the folder `key` and everything below it, and
+    subtract them from the folders above.
+    """
+    store = get_folder_stats_store()
+    if store is None:
+        return
+    try:
+        row = store.remove_subtree(key)
+        size, objects = row if row is not None else (0, 0)
+        store.apply_delta(
+            get_folder_chain(key, get_root_prefix()), -size, -objects, now_isoformat()
+        )
+    except sqlite3.Error:
+        logger.exception("Could not update folder totals for `{}`.".format(key))
+
+
+def get_object_size(bucket_name, key):
+    """
+    Return the size of `key`, or None if it does not exist.  Only called when
+    folder totals are on.
+    """
+    if get_folder_stats_store() is None:
+        return None
+    client = get_client("s3")
+    try:
+        return client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+    except client.exceptions.ClientError:
+        return None
+
+
+def add_to_totals(totals, key, size, last_modified, prefix):
+    """
+    Count the file `key` in every folder from its own up to `prefix`.
+    """
+    for folder in get_folder_chain(key, prefix):
+        total = totals.get(folder)
+        if total is None:
+            totals[folder] = [size, 1, last_modified]
+        else:
+            total[0] += size
+            total[1] += 1
+            if last_modified > total[2]:
+                total[2] = last_modified
+
+
+def sum_subtree(bucket_name, prefix):
+    """
+    List everything below `prefix` and return its folder totals.
+    """
+    # Imported here; `applib.bucket` imports this module.
+    from applib.bucket import list_all_bucket_objects
+
+    totals = {prefix: [0, 0, ""]}
+    for item in list_all_bucket_objects(bucket_name, prefix):
+        key = unquote_plus(item["Key"])
+        if key.endswith("/"):
+            totals.setdefault(key, [0, 0, ""])
+            continue
+        add_to_totals(
+            totals, key, item["Size"], item["LastModified"].isoformat(), prefix
+        )
+    return totals
+
+
+def compute_folder_stats(bucket_name, prefix, concurrency=8):
+    """
+    Compute the totals of `prefix` and every folder below it.  The top-level
+    folders are listed in parallel.  Returns the totals by folder path.
+    """
+    from applib.bucket import list_bucket_level
+
+    subfolders = []
+    totals = {prefix: [0, 0, ""]}
+    for page in list_bucket_level(bucket_name, prefix):
+        for item in page.get("CommonPrefixes", []):
+            subfolders.append(unquote_plus(item["Prefix"]))
+        for item in page.get("Contents", []):
+            key = unquote_plus(item["Key"])
+            if key != prefix:
+                add_to_totals(
+                    totals, key, item["Size"], item["LastModified"].isoformat(), prefix
+                )
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(
+            lambda folder: sum_subtree(bucket_name, folder), subfolders
+        )
+        for folder, subtotals in zip(subfolders, results):
+            totals.update(subtotals)
+            top = totals[prefix]
+            folder_total = subtotals[folder]
+            top[0] += folder_total[0]
+            top[1] += folder_total[1]
+            top[2] = max(top[2], folder_total[2])
+    return totals
+
+
+def main(args):
+    bucket_name = os.environ.get("S3_BUCKET")
+    if not bucket_name:
+        print("You must provide the environment variable `S3_BUCKET`.", file=sys.stderr)
+        sys.exit(1)
+    prefix = args.prefix
+    if prefix is None:
+        prefix = get_root_prefix()
+    elif prefix != "" and not prefix.endswith("/"):
+        prefix = prefix + "/"
+    started = time.perf_counter()
+    totals = compute_folder_stats(bucket_name, prefix, concurrency=args.concurrency)
+    FolderStatsStore(args.stats).replace_subtree(prefix, totals)
+    logger.info(
+        "Stored totals of {} folders below `{}` in {:.1f}s.".format(
+            len(totals), prefix, time.perf_counter() - started
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute folder totals.")
+    parser.add_argument(
+        "prefix",
+        action="store",
+        nargs="?",
+        help="Folder to compute.  Default: `BUCKET_ROOT`.",
+    )
+    parser.add_argument(
+        "-s",
+        "--stats",
+        action="store",
+        default=os.environ.get("FOLDER_STATS_PATH"),
+        required="FOLDER_STATS_PATH" not in os.environ,
+        help="Folder totals database.  Default: `FOLDER_STATS_PATH`.",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        action="store",
+        type=int,
+        default=8,
+        help="Folders listed in parallel.",
+    )
+    args = parser.parse_args()
+    main(args)
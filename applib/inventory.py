@@ -0,0 +1,500 @@
+#! /usr/bin/env python
+
+"""
+Local folder index built from S3 Inventory reports.
+
+An ingestion job reads an inventory manifest (`manifest.json`) and its CSV or
+Parquet data files into a SQLite database with one row per folder entry,
+keyed by (parent folder, name).  A folder listing is then a range scan on that
+key instead of a series of ListObjectsV2 calls.
+
+Run the job with:
+
+    python -m applib.inventory -i /path/to/index.db s3://bucket/.../manifest.json
+
+The manifest may also be a local path; data files are then looked up below
+`--data-root` (by default, the directory of the manifest).
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+
+from logzero import logger
+
+from applib.clients import get_client
+
+INSERT_BATCH_SIZE = 10000
+
+
+class InventoryError(Exception):
+    """
+    An inventory manifest or data file could not be read.
+    """
+
+
+def get_index_max_age():
+    """
+    Return the age in seconds (measured from the creation of the inventory)
+    after which the index is no longer used.
+    """
+    return float(os.environ.get("INVENTORY_MAX_AGE", "86400"))
+
+
+def get_parent(key):
+    """
+    Return the folder that contains `key` (a file or a folder ending with
+    `/`), with a trailing slash, or an empty string at the bucket root.
+    """
+    pos = key.rstrip("/").rfind("/")
+    return key[: pos + 1]
+
+
+def format_last_modified(value):
+    """
+    Return an inventory `LastModifiedDate` in the format of live listings.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+class InventoryIndex:
+    """
+    Folder index in a SQLite database.
+
+    Besides the entries, the database records the source bucket, the indexed
+    prefix and the creation time of the inventory.  Folders changed by this
+    application after that time are recorded as dirty and are listed live,
+    with everything below them.  The folders above a change are recorded as
+    stale: their own listing can change (a folder appears or disappears with
+    its last file), but the folders below them can still be served.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._meta = None
+        self._meta_stamp = None
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    @staticmethod
+    def create_schema(conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries"
+            " (parent TEXT NOT NULL, name TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_modified TEXT NOT NULL,"
+            " PRIMARY KEY (parent, name)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirty"
+            " (prefix TEXT PRIMARY KEY, marked_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stale"
+            " (prefix TEXT PRIMARY KEY, marked_at REAL NOT NULL)"
+        )
+
+    def get_meta(self):
+        """
+        Return the index metadata, or None if there is no index file.
+        Reloaded when ingestion replaces the file.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns)
+        with self._lock:
+            if stamp != self._meta_stamp:
+                with self._connect() as conn:
+                    # Indexes built before stale folders were recorded.
+                    self.create_schema(conn)
+                    self._meta = dict(conn.execute("SELECT name, value FROM meta"))
+                self._meta_stamp = stamp
+            return self._meta
+
+    def can_serve(self, bucket_name, bucket_path):
+        """
+        Return True if the folder `bucket_path` can be listed from the index.
+        """
+        meta = self.get_meta()
+        if not meta or meta.get("source_bucket") != bucket_name:
+            return False
+        if not bucket_path.startswith(meta.get("prefix", "")):
+            return False
+        if time.time() - float(meta["created_at"]) >= get_index_max_age():
+            return False
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM dirty"
+                " WHERE substr(?, 1, length(prefix)) = prefix"
+                " UNION ALL SELECT 1 FROM stale WHERE prefix = ? LIMIT 1",
+                (bucket_path, bucket_path),
+            ).fetchone()
+        return row is None
+
+    def list_folder(self, bucket_path, after=None, limit=None):
+        """
+        Return (name, size, last_modified) rows of the entries directly below
+        `bucket_path` in key order.  Folder names end with `/`.
+        """
+        query = "SELECT name, size, last_modified FROM entries WHERE parent = ?"
+        params = [bucket_path]
+        if after is not None:
+            query += " AND name > ?"
+            params.append(after)
+        query += " ORDER BY name"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def walk_files(self, bucket_path):
+        """
+        Generate (parent, name, size, last_modified) rows of the files below
+        `bucket_path` (at any depth) in key order of their folders.
+        """
+        query = "SELECT parent, name, size, last_modified FROM entries"
+        query += " WHERE parent >= ?"
+        params = [bucket_path]
+        if bucket_path != "":
+            # Folder paths end with `/`; `0` is the next character.
+            query += " AND parent < ?"
+            params.append(bucket_path[:-1] + "0")
+        query += " AND substr(name, -1) != '/' ORDER BY parent, name"
+        conn = self._connect()
+        try:
+            yield from conn.execute(query, params)
+        finally:
+            conn.close()
+
+    def mark_dirty(self, key):
+        """
+        Stop answering listings of the folder containing `key` (and of the
+        folders below it) from the index, and of every folder above it, like
+        `ListingCache.invalidate_key()`.
+        """
+        if self.get_meta() is None:
+            return
+        folder = get_parent(key)
+        ancestors = []
+        while folder != "":
+            folder = get_parent(folder)
+            ancestors.append(folder)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO dirty (prefix, marked_at) VALUES (?, ?)",
+                (get_parent(key), now),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO stale (prefix, marked_at) VALUES (?, ?)",
+                [(ancestor, now) for ancestor in ancestors],
+            )
+
+
+_indexes_lock = threading.Lock()
+_indexes = {}
+
+
+def get_listing_index():
+    """
+    Return the index at `INVENTORY_INDEX_PATH`, or None if index mode is off.
+    """
+    path = os.environ.get("INVENTORY_INDEX_PATH")
+    if not path:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = InventoryIndex(path)
+            _indexes[path] = index
+    return index
+
+
+def mark_index_dirty(bucket_name, key):
+    """
+    Record that this application changed `key`.
+    """
+    index = get_listing_index()
+    if index is None:
+        return
+    meta = index.get_meta()
+    if meta and meta.get("source_bucket") == bucket_name:
+        try:
+            index.mark_dirty(key)
+        except sqlite3.Error:
+            logger.exception("Could not mark `{}` dirty in the index.".format(key))
+
+
+def parse_s3_url(url):
+    """
+    Split `s3://bucket/key` into (bucket, key).
+    """
+    bucket, _, key = url[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def load_manifest(location):
+    """
+    Load an inventory manifest from a local path or an `s3://` URL.
+    """
+    if location.startswith("s3://"):
+        bucket, key = parse_s3_url(location)
+        resp = get_client("s3").get_object(Bucket=bucket, Key=key)
+        return json.loads(resp["Body"].read())
+    with open(location) as f:
+        return json.load(f)
+
+
+def open_data_file(manifest, location, file_key, data_root=None):
+    """
+    Return a seekable binary file object for the data file `file_key`.
+    """
+    if location.startswith("s3://"):
+        bucket = manifest["destinationBucket"].split(":::")[-1]
+        f = tempfile.TemporaryFile()
+        get_client("s3").download_fileobj(bucket, file_key, f)
+        f.seek(0)
+        return f
+    if data_root is None:
+        data_root = os.path.dirname(os.path.abspath(location))
+    # Inventory reports keep data files in `data/` next to the dated folders
+    # that hold the manifests; also accept a copy of the destination bucket.
+    name = os.path.basename(file_key)
+    candidates = [
+        os.path.join(data_root, file_key),
+        os.path.join(data_root, name),
+        os.path.join(data_root, "data", name),
+        os.path.join(data_root, "..", "data", name),
+    ]
+    for path in candidates:
+        if os.path.exists(path):
+            return open(path, "rb")
+    raise InventoryError("Inventory file `{}` not found.".format(file_key))
+
+
+def generate_csv_rows(f, schema):
+    """
+    Generate row dicts from a gzipped CSV inventory file.
+    Keys in CSV inventories are URL-encoded.
+    """
+    with gzip.open(f, "rt", newline="") as text:
+        for row in csv.reader(text):
+            record = dict(zip(schema, row))
+            record["Key"] = unquote_plus(record["Key"])
+            yield record
+
+
+def generate_parquet_rows(f, schema):
+    """
+    Generate row dicts from a Parquet inventory file.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise InventoryError("Parquet inventories require `pyarrow`.")
+    columns = [c for c in ("Key", "Size", "LastModifiedDate") if c in schema]
+    columns += [c for c in ("IsLatest", "IsDeleteMarker") if c in schema]
+    for batch in pq.ParquetFile(f).iter_batches(columns=columns):
+        yield from batch.to_pylist()
+
+
+def is_current_object(record):
+    """
+    Skip noncurrent versions and delete markers of versioned inventories.
+    """
+    if str(record.get("IsLatest", "true")).lower() == "false":
+        return False
+    if str(record.get("IsDeleteMarker", "false")).lower() == "true":
+        return False
+    return True
+
+
+def generate_inventory_rows(manifest, location, data_root=None):
+    """
+    Generate the object records listed by an inventory manifest.
+    """
+    file_format = manifest.get("fileFormat", "CSV").upper()
+    schema = [field.strip() for field in manifest["fileSchema"].split(",")]
+    if file_format == "CSV":
+        generate_rows = generate_csv_rows
+    elif file_format == "PARQUET":
+        generate_rows = generate_parquet_rows
+    else:
+        raise InventoryError("Unsupported inventory format `{}`.".format(file_format))
+    for entry in manifest["files"]:
+        logger.info("Reading inventory file `{}` ...".format(entry["key"]))
+        with open_data_file(manifest, location, entry["key"], data_root) as f:
+            for record in generate_rows(f, schema):
+                if is_current_object(record):
+                    yield record
+
+
+def generate_index_entries(records, prefix):
+    """
+    Generate (parent, name, size, last_modified) entries for the objects
+    below `prefix` and for the folders that contain them.
+    """
+    seen_folders = set()
+    for record in records:
+        key = record["Key"]
+        if not key.startswith(prefix):
+            continue
+        if not key.endswith("/"):
+            yield (
+                get_parent(key),
+                key[len(get_parent(key)) :],
+                int(record.get("Size") or 0),
+                format_last_modified(record["LastModifiedDate"]),
+            )
+        folder = key if key.endswith("/") else get_parent(key)
+        while len(folder) > len(prefix) and folder not in seen_folders:
+            seen_folders.add(folder)
+            parent = get_parent(folder)
+            yield (parent, folder[len(parent) :], 0, "")
+            folder = parent
+
+
+def get_dirty_since(index_path, since, table="dirty"):
+    """
+    Return the (prefix, marked_at) rows of the existing index at
+    `index_path` that were marked dirty (or, with `table="stale"`, stale)
+    after `since`.
+    """
+    if not os.path.exists(index_path):
+        return []
+    assert table in ("dirty", "stale")
+    try:
+        with sqlite3.connect(index_path, timeout=5) as conn:
+            return conn.execute(
+                "SELECT prefix, marked_at FROM {} WHERE marked_at > ?".format(table),
+                (since,),
+            ).fetchall()
+    except sqlite3.Error:
+        logger.exception("Could not read dirty folders from `{}`.".format(index_path))
+        return []
+
+
+def ingest_inventory(location, index_path, prefix="", data_root=None):
+    """
+    Build the index at `index_path` from the inventory manifest at
+    `location`.  The new index replaces the old one atomically; folders the
+    application changed after the inventory was taken stay dirty or stale.
+    Returns the number of index entries.
+    """
+    manifest = load_manifest(location)
+    created_at = int(manifest["creationTimestamp"]) / 1000.0
+    source_bucket = manifest["sourceBucket"]
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=".inventory-")
+    os.close(fd)
+    count = 0
+    try:
+        conn = sqlite3.connect(tmp_path)
+        with conn:
+            InventoryIndex.create_schema(conn)
+            records = generate_inventory_rows(manifest, location, data_root)
+            batch = []
+            for entry in generate_index_entries(records, prefix):
+                batch.append(entry)
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", batch
+                    )
+                    count += len(batch)
+                    batch = []
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", batch
+            )
+            count += len(batch)
+            conn.executemany(
+                "INSERT INTO dirty (prefix, marked_at) VALUES (?, ?)",
+                get_dirty_since(index_path, created_at),
+            )
+            conn.executemany(
+                "INSERT INTO stale (prefix, marked_at) VALUES (?, ?)",
+                get_dirty_since(index_path, created_at, table="stale"),
+            )
+            conn.executemany(
+                "INSERT INTO meta (name, value) VALUES (?, ?)",
+                [
+                    ("source_bucket", source_bucket),
+                    ("prefix", prefix),
+                    ("created_at", created_at),
+                    ("ingested_at", time.time()),
+                ],
+            )
+        conn.close()
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    logger.info(
+        "Indexed {} entries of `{}` from the inventory of {}.".format(
+            count, source_bucket, datetime.fromtimestamp(created_at, timezone.utc)
+        )
+    )
+    return count
+
+
+def main(args):
+    prefix = args.prefix
+    if prefix is None:
+        prefix = os.environ.get("BUCKET_ROOT", "")
+        if prefix != "" and not prefix.endswith("/"):
+            prefix = prefix + "/"
+    try:
+        ingest_inventory(
+            args.manifest, args.index, prefix=prefix, data_root=args.data_root
+        )
+    except InventoryError as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the listing index from an S3 Inventory manifest."
+    )
+    parser.add_argument(
+        "manifest", action="store", help="Path or s3:// URL of `manifest.json`."
+    )
+    parser.add_argument(
+        "-i",
+        "--index",
+        action="store",
+        default=os.environ.get("INVENTORY_INDEX_PATH"),
+        required="INVENTORY_INDEX_PATH" not in os.environ,
+        help="Index database.  Default: `INVENTORY_INDEX_PATH`.",
+    )
+    parser.add_argument(
+        "-p",
+        "--prefix",
+        action="store",
+        help="Only index keys below this prefix.  Default: `BUCKET_ROOT`.",
+    )
+    parser.add_argument(
+        "-d",
+        "--data-root",
+        action="store",
+        help="Directory with the data files of a local manifest.",
+    )
+    args = parser.parse_args()
+    main(args)
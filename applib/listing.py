@@ -0,0 +1,232 @@
+"""
+Compact folder listings.  The entries of a listing are kept in parallel
+columns (names, and sizes and modification times in typed arrays) instead of
+one dict per entry, and modification times are formatted only when an entry
+is rendered or serialized.
+"""
+
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from flask.json.provider import DefaultJSONProvider
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+# Stored for entries without a modification time (e.g. folders).
+NO_TIME = -(2**63)
+# Stored for entries without an object count.
+NO_COUNT = -1
+# Fields of an entry, as used by the templates and the JSON API.
+FIELDS = ("key", "size", "last_modified", "objects")
+
+
+def to_timestamp(value):
+    """
+    Return `value` (a datetime, an ISO 8601 string, or an empty string or
+    None for no time) as integer microseconds since the epoch.
+    """
+    if value is None or value == "":
+        return NO_TIME
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def format_timestamp(timestamp):
+    """
+    Return the ISO 8601 form (UTC) of `timestamp`, or an empty string.
+    """
+    if timestamp == NO_TIME:
+        return ""
+    return (EPOCH + ONE_MICROSECOND * timestamp).isoformat()
+
+
+class Entry:
+    """
+    One entry of an `EntryList`, made when the list is iterated or indexed.
+    Fields can be used as attributes or, like the dicts listings used to
+    hold, as items; `last_modified` is formatted on access.
+    """
+
+    __slots__ = ("key", "size", "timestamp", "objects")
+
+    def __init__(self, key, size, timestamp, objects=None):
+        self.key = key
+        self.size = size
+        self.timestamp = timestamp
+        self.objects = objects
+
+    @property
+    def last_modified(self):
+        return format_timestamp(self.timestamp)
+
+    def __getitem__(self, name):
+        if name not in FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        if name not in FIELDS:
+            return default
+        value = getattr(self, name)
+        return default if value is None else value
+
+    def to_dict(self):
+        """
+        Return the entry as a dict; `objects` is only present if known.
+        """
+        result = {
+            "key": self.key,
+            "last_modified": self.last_modified,
+            "size": self.size,
+        }
+        if self.objects is not None:
+            result["objects"] = self.objects
+        return result
+
+    def __repr__(self):
+        return "Entry({!r})".format(self.to_dict())
+
+
+class EntryList:
+    """
+    The files or folders of a listing, in parallel columns.  Iterating or
+    indexing yields `Entry` records; slicing yields a new `EntryList`.
+    """
+
+    __slots__ = ("keys", "sizes", "times", "objects")
+
+    def __init__(self):
+        self.keys = []
+        self.sizes = array("q")
+        self.times = array("q")
+        # Object counts of folders, created when the first one is added.
+        self.objects = None
+
+    def append(self, key, size, last_modified, objects=None):
+        """
+        Add an entry.  `last_modified` is a datetime, an ISO 8601 string, or
+        an empty string.
+        """
+        if objects is not None and self.objects is None:
+            self.objects = array("q", [NO_COUNT]) * len(self.keys)
+        self.keys.append(key)
+        self.sizes.append(size)
+        self.times.append(to_timestamp(last_modified))
+        if self.objects is not None:
+            self.objects.append(NO_COUNT if objects is None else objects)
+
+    def extend(self, other):
+        """
+        Add the entries of the `EntryList` `other`.
+        """
+        if other.objects is not None and self.objects is None:
+            self.objects = array("q", [NO_COUNT]) * len(self.keys)
+        self.keys.extend(other.keys)
+        self.sizes.extend(other.sizes)
+        self.times.extend(other.times)
+        if self.objects is not None:
+            if other.objects is None:
+                self.objects.extend(array("q", [NO_COUNT]) * len(other.keys))
+            else:
+                self.objects.extend(other.objects)
+
+    def take(self, indices):
+        """
+        Return a new `EntryList` of the entries at `indices`, in that order.
+        """
+        result = EntryList()
+        keys = self.keys
+        sizes = self.sizes
+        times = self.times
+        result.keys = [keys[i] for i in indices]
+        result.sizes = array("q", [sizes[i] for i in indices])
+        result.times = array("q", [times[i] for i in indices])
+        if self.objects is not None:
+            objects = self.objects
+            result.objects = array("q", [objects[i] for i in indices])
+        return result
+
+    def sorted_by_key(self):
+        """
+        Return a new `EntryList` sorted by name.
+        """
+        return self.take(sorted(range(len(self.keys)), key=self.keys.__getitem__))
+
+    def get_column(self, name):
+        """
+        Return the raw values of the field `name`, e.g. for sorting.
+        Modification times are integers; see `to_timestamp()`.
+        """
+        if name == "key":
+            return self.keys
+        if name == "size":
+            return self.sizes
+        if name == "last_modified":
+            return self.times
+        if name == "objects":
+            if self.objects is None:
+                return array("q", [NO_COUNT]) * len(self.keys)
+            return self.objects
+        raise KeyError(name)
+
+    def total_size(self):
+        return sum(self.sizes)
+
+    def update_hash(self, h):
+        """
+        Feed the names, sizes, times and object counts of the entries to the
+        hash object `h`.
+        """
+        h.update("\0".join(self.keys).encode("utf-8"))
+        h.update(self.sizes.tobytes())
+        h.update(self.times.tobytes())
+        if self.objects is not None:
+            h.update(self.objects.tobytes())
+
+    def to_list(self):
+        """
+        Return the entries as a list of dicts.
+        """
+        return [entry.to_dict() for entry in self]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        if self.objects is None:
+            for key, size, timestamp in zip(self.keys, self.sizes, self.times):
+                yield Entry(key, size, timestamp)
+            return
+        for key, size, timestamp, objects in zip(
+            self.keys, self.sizes, self.times, self.objects
+        ):
+            yield Entry(key, size, timestamp, None if objects == NO_COUNT else objects)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(len(self.keys))[index])
+        objects = None
+        if self.objects is not None and self.objects[index] != NO_COUNT:
+            objects = self.objects[index]
+        return Entry(self.keys[index], self.sizes[index], self.times[index], objects)
+
+    def __repr__(self):
+        return "EntryList({} entries)".format(len(self.keys))
+
+
+class ListingJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that serializes `EntryList` and `Entry` objects like the
+    lists of dicts they replace.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, EntryList):
+            return o.to_list()
+        if isinstance(o, Entry):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
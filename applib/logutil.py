@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import random
+
+import logzero
+from logzero import logger
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON objects.  Fields passed as
+    `extra={"fields": {...}}` become top-level keys, so they can be queried
+    with CloudWatch Logs Insights or metric filters.
+    """
+
+    def format(self, record):
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_log_level():
+    return getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper())
+
+
+def init_logging():
+    """
+    Apply `LOG_LEVEL` to the root and application loggers and, if
+    `LOG_FORMAT` is `json`, switch the application logger to structured
+    output.
+    """
+    level = get_log_level()
+    logging.basicConfig(level=level)
+    logzero.loglevel(level)
+    if os.environ.get("LOG_FORMAT", "text").lower() == "json":
+        logzero.formatter(StructuredFormatter())
+
+
+def get_key_sample_rate():
+    """
+    Return the fraction (0-1) of listed keys that are logged individually
+    at debug level.
+    """
+    rate = float(os.environ.get("LOG_KEY_SAMPLE_RATE", "1"))
+    return max(0.0, min(rate, 1.0))
+
+
+def get_key_sampler():
+    """
+    Return a function that tells whether to log a key, or None if no keys
+    will be logged.  Checked once per listing rather than once per key.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return None
+    rate = get_key_sample_rate()
+    if rate <= 0.0:
+        return None
+    if rate >= 1.0:
+        return lambda: True
+    return lambda: random.random() < rate
+
+
+def log_event(level, event, message, *args, **fields):
+    """
+    Log `message % args` with structured `fields`.  Formatting is deferred
+    until the record is emitted.
+    """
+    if logger.isEnabledFor(level):
+        fields["event"] = event
+        logger.log(level, message, *args, extra={"fields": fields}, stacklevel=2)
@@ -11,6 +11,15 @@ remove_file = "remove_file"
 permission_set = set(
     [list_files, create_folder, remove_folder, download_file, upload_file, remove_file]
 )
+# Bit assigned to each permission in a compact permission mask.
+permission_bits = {
+    list_files: 1,
+    create_folder: 2,
+    remove_folder: 4,
+    download_file: 8,
+    upload_file: 16,
+    remove_file: 32,
+}
 
 
 def get_default_permissions():
@@ -28,11 +37,42 @@ def get_default_permissions():
     return permissions
 
 
+def permissions_to_mask(permissions):
+    """
+    Convert a mapping of permission names to booleans into a permission mask.
+    """
+    mask = 0
+    for perm, bit in permission_bits.items():
+        if permissions.get(perm):
+            mask |= bit
+    return mask
+
+
+def mask_to_permissions(mask):
+    """
+    Convert a permission mask into a mapping of permission names to booleans.
+    """
+    return {perm: bool(mask & bit) for perm, bit in permission_bits.items()}
+
+
+def compact_identity(identity):
+    """
+    Replace the permissions mapping of `identity` with a permission mask.
+    """
+    permissions = identity.get("permissions")
+    if isinstance(permissions, dict):
+        identity["permissions"] = permissions_to_mask(permissions)
+    return identity
+
+
 def has_permission(perm):
     """
     Does the current session have the permission?
+    Permissions are stored as a mask (see `permission_bits`); a mapping of
+    permission names to booleans is also accepted.
     """
-    if perm not in permission_set:
+    bit = permission_bits.get(perm)
+    if bit is None:
         logger.warn("Check for invalid permission `{}`.".format(perm))
         return False
     identity = session.get("identity")
@@ -42,4 +82,6 @@ def has_permission(perm):
     if permissions is None:
         logger.warn("Session has identity by no permissions structure.")
         return False
+    if isinstance(permissions, int):
+        return bool(permissions & bit)
     return bool(permissions.get(perm))
@@ -0,0 +1,138 @@
+"""
+Speculative prefetch of child folder listings.  After a folder is rendered,
+the first page of its first few subfolders is listed in the background, so
+that clicking into one of them is answered from the listing cache.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, session
+from logzero import logger
+
+from applib.bucket import get_page_cache_key, list_folder_page
+from applib.cache import listing_cache
+from applib.inventory import get_listing_index
+
+# Length in seconds of the window of the per-user budget.
+BUDGET_WINDOW = 60.0
+# Prefetches queued per worker thread before further ones are dropped.
+MAX_PENDING_PER_WORKER = 8
+
+_lock = threading.Lock()
+_executor = None
+_pending = set()
+_budgets = {}
+_counters = {"started": 0, "completed": 0, "failed": 0, "over_budget": 0}
+
+
+def get_prefetch_folders():
+    """
+    Return the number of child folders prefetched per rendered folder.  On
+    Lambda the instance is frozen once a response is sent, so prefetches
+    would only run during later requests; the default there is 0.
+    """
+    default = "0" if "AWS_LAMBDA_FUNCTION_NAME" in os.environ else "5"
+    return max(0, int(os.environ.get("PREFETCH_FOLDERS", default)))
+
+
+def get_prefetch_concurrency():
+    """
+    Return the number of prefetches that run at once per process.
+    """
+    return max(1, int(os.environ.get("PREFETCH_CONCURRENCY", "4")))
+
+
+def get_prefetch_budget():
+    """
+    Return the number of prefetches a user may start per minute.
+    """
+    return max(0, int(os.environ.get("PREFETCH_USER_BUDGET", "60")))
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_prefetch_concurrency(), thread_name_prefix="prefetch"
+        )
+    return _executor
+
+
+def take_budget(username, wanted, now):
+    """
+    Take up to `wanted` prefetches from the budget of `username` and return
+    the number granted.  Call with `_lock` held.
+    """
+    window_start, used = _budgets.get(username, (now, 0))
+    if now - window_start >= BUDGET_WINDOW:
+        window_start, used = now, 0
+    granted = max(0, min(wanted, get_prefetch_budget() - used))
+    _budgets[username] = (window_start, used + granted)
+    if len(_budgets) > 1000:
+        for name, (start, _) in list(_budgets.items()):
+            if now - start >= BUDGET_WINDOW:
+                del _budgets[name]
+    return granted
+
+
+def prefetch_child_folders(bucket_name, bucket_path, folders):
+    """
+    List the first page of the first `PREFETCH_FOLDERS` of `folders` (the
+    folder `EntryList` of a listing of `bucket_path`) in the background.
+    Folders that are cached, served from the inventory index or already
+    being prefetched are skipped.
+    """
+    limit = get_prefetch_folders()
+    if limit == 0 or not folders or not listing_cache.enabled:
+        return
+    index = get_listing_index()
+    candidates = []
+    for key in folders.keys[:limit]:
+        child = bucket_path + key
+        if listing_cache.contains(get_page_cache_key(bucket_name, child)):
+            continue
+        if index is not None and index.can_serve(bucket_name, child):
+            continue
+        candidates.append(child)
+    if not candidates:
+        return
+    app = current_app._get_current_object()
+    username = session["identity"]["sub"]
+    max_pending = get_prefetch_concurrency() * MAX_PENDING_PER_WORKER
+    with _lock:
+        candidates = [
+            child for child in candidates if (bucket_name, child) not in _pending
+        ]
+        candidates = candidates[: max(0, max_pending - len(_pending))]
+        granted = take_budget(username, len(candidates), time.monotonic())
+        _counters["over_budget"] += len(candidates) - granted
+        executor = get_executor()
+        for child in candidates[:granted]:
+            _pending.add((bucket_name, child))
+            _counters["started"] += 1
+            executor.submit(prefetch_folder, app, bucket_name, child)
+
+
+def prefetch_folder(app, bucket_name, bucket_path):
+    try:
+        with app.app_context():
+            list_folder_page(bucket_name, bucket_path)
+    except Exception as ex:
+        logger.warning("Could not prefetch `%s`: %s", bucket_path, ex)
+        outcome = "failed"
+    else:
+        outcome = "completed"
+    with _lock:
+        _pending.discard((bucket_name, bucket_path))
+        _counters[outcome] += 1
+
+
+def prefetch_stats():
+    """
+    Return prefetch counters.
+    """
+    with _lock:
+        return dict(_counters, pending=len(_pending))
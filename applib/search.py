@@ -0,0 +1,100 @@
+import fnmatch
+import os
+import time
+from urllib.parse import unquote_plus
+
+from logzero import logger
+
+from applib.bucket import list_all_bucket_objects, resource_to_bucket_path
+from applib.inventory import get_listing_index
+
+
+def get_search_max_results():
+    """
+    Return the maximum number of results a search returns.
+    """
+    return max(1, int(os.environ.get("SEARCH_MAX_RESULTS", "200")))
+
+
+def get_search_time_budget():
+    """
+    Return the number of seconds a search may scan keys.
+    """
+    return float(os.environ.get("SEARCH_TIME_BUDGET", "10"))
+
+
+def make_matcher(query):
+    """
+    Return a case-insensitive predicate for keys relative to the searched
+    folder.  Queries with `*`, `?` or `[` are globs, matched against the file
+    name, or against the relative key if the glob contains `/`.  Other
+    queries match any part of the relative key.
+    """
+    query = query.lower()
+    if any(c in query for c in "*?["):
+        if "/" in query:
+            return lambda key: fnmatch.fnmatchcase(key.lower(), query)
+        return lambda key: fnmatch.fnmatchcase(key.rsplit("/", 1)[-1].lower(), query)
+    return lambda key: query in key.lower()
+
+
+def generate_candidates(bucket_name, bucket_path):
+    """
+    Generate (key, size, last_modified) for the files below `bucket_path`.
+    Keys are relative to `bucket_path`.
+    """
+    index = get_listing_index()
+    if index is not None and index.can_serve(bucket_name, bucket_path):
+        for parent, name, size, last_modified in index.walk_files(bucket_path):
+            yield parent[len(bucket_path) :] + name, size, last_modified
+        return
+    for item in list_all_bucket_objects(bucket_name, bucket_path):
+        key = unquote_plus(item["Key"])
+        if key.endswith("/") or not key.startswith(bucket_path):
+            continue
+        yield key[len(bucket_path) :], item["Size"], item["LastModified"].isoformat()
+
+
+def search_bucket(path, query, max_results=None):
+    """
+    Generate the files below `path` that match `query`, then a summary:
+
+        {"done": True, "results": n, "scanned": n, "truncated": reason}
+
+    `truncated` is `limit` if the result cap was reached, `time` if the time
+    budget ran out, and None if the whole subtree was searched.  Keys are
+    scanned in order and matching keys are passed through as they are found,
+    so the work per request is bounded by the caps.
+    """
+    bucket_name = os.environ.get("S3_BUCKET")
+    message = "You must provide the environment variable `S3_BUCKET`."
+    assert bucket_name, Exception(message)
+    bucket_path = resource_to_bucket_path(path)
+    limit = get_search_max_results()
+    if max_results is not None:
+        limit = max(1, min(max_results, limit))
+    deadline = time.monotonic() + get_search_time_budget()
+    matches = make_matcher(query)
+    results = 0
+    scanned = 0
+    truncated = None
+    for key, size, last_modified in generate_candidates(bucket_name, bucket_path):
+        scanned += 1
+        if matches(key):
+            yield {"key": key, "size": size, "last_modified": last_modified}
+            results += 1
+            if results >= limit:
+                truncated = "limit"
+                break
+        if time.monotonic() >= deadline:
+            truncated = "time"
+            break
+    logger.info(
+        "Searched `%s` for `%s`: %d results, %d keys scanned, truncated: %s.",
+        bucket_path,
+        query,
+        results,
+        scanned,
+        truncated,
+    )
+    yield {"done": True, "results": results, "scanned": scanned, "truncated": truncated}
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from logzero import logger
+
+from applib.clients import get_client
+
+
+class SecretCache:
+    """
+    Cached Secrets Manager secret string.
+
+    The value is reused for `ttl` seconds.  During the last `refresh_ahead`
+    seconds of that window a background thread fetches the current version,
+    so requests do not wait on Secrets Manager.  When the `VersionId`
+    changes (e.g. after a rotation) the old value is kept as
+    `previous_value`.  If `cache_dir` is set, the value is also written to a
+    file there that a new process in the same container can reuse.
+    """
+
+    def __init__(
+        self, secret_id, region=None, ttl=3600, refresh_ahead=300, cache_dir=None
+    ):
+        self.secret_id = secret_id
+        self.region = region
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.cache_dir = cache_dir
+        self.value = None
+        self.version_id = None
+        self.previous_value = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """
+        Return the secret string.
+        """
+        age = time.time() - self.fetched_at
+        if self.value is not None and age < self.ttl - self.refresh_ahead:
+            return self.value
+        if self.value is None and self.load_file_cache():
+            return self.get()
+        if self.value is not None and age < self.ttl:
+            self.refresh_in_background()
+            return self.value
+        with self._lock:
+            if time.time() - self.fetched_at >= self.ttl or self.value is None:
+                try:
+                    self.refresh()
+                except Exception:
+                    if self.value is None:
+                        raise
+                    message = "Could not refresh secret `{}`; using cached value."
+                    logger.exception(message.format(self.secret_id))
+        return self.value
+
+    def refresh(self):
+        """
+        Fetch the current version of the secret.
+        """
+        client = get_client("secretsmanager", region_name=self.region)
+        resp = client.get_secret_value(SecretId=self.secret_id)
+        version_id = resp.get("VersionId")
+        if self.version_id is not None and version_id != self.version_id:
+            logger.info(
+                "Secret `{}` changed version from `{}` to `{}`.".format(
+                    self.secret_id, self.version_id, version_id
+                )
+            )
+            self.previous_value = self.value
+        self.value = resp["SecretString"]
+        self.version_id = version_id
+        self.fetched_at = time.time()
+        self.write_file_cache()
+
+    def refresh_in_background(self):
+        """
+        Start refreshing the secret in a daemon thread, unless a refresh is
+        already running.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._lock:
+                    self.refresh()
+            except Exception:
+                logger.exception(
+                    "Background refresh of secret `{}` failed.".format(self.secret_id)
+                )
+            finally:
+                self._refreshing = False
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+    def get_file_cache_path(self):
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256(self.secret_id.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "s3browser-secret-{}.json".format(digest))
+
+    def load_file_cache(self):
+        """
+        Load a still-valid value from the file cache.
+        Returns True if a value was loaded.
+        """
+        path = self.get_file_cache_path()
+        if path is None:
+            return False
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if time.time() - cached.get("fetched_at", 0) >= self.ttl:
+            return False
+        with self._lock:
+            if self.value is None:
+                self.value = cached["value"]
+                self.version_id = cached.get("version_id")
+                self.fetched_at = cached["fetched_at"]
+        logger.debug("Loaded secret `{}` from the file cache.".format(self.secret_id))
+        return True
+
+    def write_file_cache(self):
+        """
+        Atomically write the current value to the file cache (mode 0600).
+        """
+        path = self.get_file_cache_path()
+        if path is None:
+            return
+        record = {
+            "value": self.value,
+            "version_id": self.version_id,
+            "fetched_at": self.fetched_at,
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".secret-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write the secret file cache.")
+
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def get_secret_cache(secret_id, region=None):
+    """
+    Return the process-wide cache for `secret_id`.
+    """
+    key = (secret_id, region)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = SecretCache(
+                secret_id,
+                region=region,
+                ttl=float(os.environ.get("SECRET_CACHE_TTL", "3600")),
+                refresh_ahead=float(os.environ.get("SECRET_REFRESH_AHEAD", "300")),
+                cache_dir=os.environ.get("SECRET_CACHE_DIR"),
+            )
+            _caches[key] = cache
+    return cache
@@ -0,0 +1,282 @@
+import importlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import (SecureCookieSessionInterface, SessionInterface,
+                            SessionMixin)
+from itsdangerous import BadSignature, Signer
+from logzero import logger
+from werkzeug.datastructures import CallbackDict
+
+from applib.clients import get_client
+from applib.secretcache import get_secret_cache
+
+
+def refresh_secret_key(app):
+    """
+    Set the app secret key from the (cached) `APP_SECRET` secret.
+    After a rotation the previous key stays valid as a fallback, so existing
+    sessions survive.
+    """
+    # Set the secret key to some random bytes. Keep this really secret!
+    secret_name = os.environ["APP_SECRET"]
+    secret_cache = get_secret_cache(secret_name, region=os.environ.get("AWS_REGION"))
+    secret_key = secret_cache.get()
+    if secret_key != app.secret_key:
+        if app.secret_key is not None:
+            logger.info("Application secret key was rotated.")
+        fallbacks = []
+        if secret_cache.previous_value is not None:
+            fallbacks.append(secret_cache.previous_value)
+        app.config["SECRET_KEY_FALLBACKS"] = fallbacks
+        app.secret_key = secret_key
+
+
+class LazySecretKeySessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie sessions that resolve the app secret key on first need and pick
+    up rotated keys from the secret cache.
+    """
+
+    def get_signing_serializer(self, app):
+        refresh_secret_key(app)
+        return super().get_signing_serializer(app)
+
+
+class SQLiteSessionStore:
+    """
+    Session store in a local SQLite database, for development and tests.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions"
+                " (id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, sid):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires > ?",
+                (sid, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set(self, sid, data, ttl):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                (sid, data, now + ttl),
+            )
+
+    def delete(self, sid):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+
+class DynamoDBSessionStore:
+    """
+    Session store in a DynamoDB table with a string partition key `id`.
+    The `expires` attribute can be used as the table's TTL attribute.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def get(self, sid):
+        client = get_client("dynamodb")
+        resp = client.get_item(
+            TableName=self.table_name, Key={"id": {"S": sid}}, ConsistentRead=True
+        )
+        item = resp.get("Item")
+        # Expired items are removed by DynamoDB TTL eventually, not at once.
+        if item is None or float(item["expires"]["N"]) <= time.time():
+            return None
+        return item["data"]["S"]
+
+    def set(self, sid, data, ttl):
+        client = get_client("dynamodb")
+        client.put_item(
+            TableName=self.table_name,
+            Item={
+                "id": {"S": sid},
+                "data": {"S": data},
+                "expires": {"N": str(int(time.time() + ttl))},
+            },
+        )
+
+    def delete(self, sid):
+        client = get_client("dynamodb")
+        client.delete_item(TableName=self.table_name, Key={"id": {"S": sid}})
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    Session whose data lives in a session store; the cookie only carries
+    its signed ID.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # ID to remove from the store after `regenerate()`.
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new random ID; the old ID stops working.
+        """
+        if self.replaced_sid is None and not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Sessions kept in a server-side store (see `SQLiteSessionStore` and
+    `DynamoDBSessionStore`).  The cookie carries only a random session ID,
+    signed with the app secret key.
+    """
+
+    salt = "session-id"
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_signer(self, app):
+        refresh_secret_key(app)
+        keys = list(app.config.get("SECRET_KEY_FALLBACKS") or [])
+        keys.append(app.secret_key)
+        return Signer(keys, salt=self.salt)
+
+    def get_ttl(self, app):
+        return int(app.permanent_session_lifetime.total_seconds())
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode("ascii")
+            except BadSignature:
+                sid = None
+            if sid is not None:
+                data = self.store.get(sid)
+                if data is not None:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if getattr(session, "replaced_sid", None) is not None:
+            self.store.delete(session.replaced_sid)
+            session.replaced_sid = None
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    name,
+                    domain=domain,
+                    path=path,
+                    secure=secure,
+                    samesite=samesite,
+                    httponly=httponly,
+                )
+                response.vary.add("Cookie")
+            return
+        if session.modified:
+            data = self.serializer.dumps(dict(session))
+            self.store.set(session.sid, data, self.get_ttl(app))
+        if not self.should_set_cookie(app, session):
+            return
+        signer = self.get_signer(app)
+        response.set_cookie(
+            name,
+            signer.sign(session.sid).decode("ascii"),
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        response.vary.add("Cookie")
+
+
+def regenerate_session(session):
+    """
+    Give a server-side `session` a new ID, e.g. at login, so that an ID
+    known before cannot be used afterwards.  Cookie sessions are left as
+    they are.
+    """
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+def make_session_store(spec):
+    """
+    Create a session store from a `SESSION_STORE` setting:
+
+    * `sqlite` - SQLite database at `SESSION_SQLITE_PATH`.
+    * `dynamodb` - DynamoDB table `SESSION_TABLE`.
+    * `package.module:ClassName` - any class with `get(sid)`,
+      `set(sid, data, ttl)` and `delete(sid)` methods, created without
+      arguments.
+    """
+    if spec == "sqlite":
+        path = os.environ.get("SESSION_SQLITE_PATH", "/tmp/s3browser-sessions.sqlite3")
+        return SQLiteSessionStore(path)
+    if spec == "dynamodb":
+        table_name = os.environ.get("SESSION_TABLE")
+        message = "You must provide the environment variable `SESSION_TABLE`."
+        assert table_name, Exception(message)
+        return DynamoDBSessionStore(table_name)
+    module_name, sep, class_name = spec.partition(":")
+    if sep == "":
+        raise Exception("Unknown session store `{}`.".format(spec))
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
+
+
+def make_session_interface():
+    """
+    Return the session interface selected by the `SESSION_STORE` environment
+    variable.  Without it, sessions are kept in signed cookies.
+    """
+    spec = os.environ.get("SESSION_STORE")
+    if not spec:
+        return LazySecretKeySessionInterface()
+    logger.debug("Using server-side session store `{}`.".format(spec))
+    return ServerSideSessionInterface(make_session_store(spec))
@@ -0,0 +1,96 @@
+import importlib.util
+import os
+import zlib
+
+from flask import Response, request
+
+from applib.clients import config2bool
+
+# Bytes of output collected before a chunk is compressed and sent.
+FLUSH_SIZE = 16 * 1024
+
+
+def get_stream_min_rows():
+    """
+    Return the number of listing rows from which pages are streamed.
+    """
+    return int(os.environ.get("STREAM_MIN_ROWS", "500"))
+
+
+def is_compression_enabled():
+    return config2bool(os.environ.get("COMPRESS_PAGES", "true"))
+
+
+def choose_encoding():
+    """
+    Return the content coding for a streamed page: `br` if the client accepts
+    it and `brotli` is installed, else `gzip` if accepted, else None.
+    """
+    if not is_compression_enabled():
+        return None
+    accepted = request.accept_encodings
+    if accepted["br"] and importlib.util.find_spec("brotli") is not None:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def group_chunks(chunks, size=FLUSH_SIZE):
+    """
+    Join the small strings a template generates into UTF-8 chunks of at least
+    `size` bytes (except the last).
+    """
+    parts = []
+    length = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        parts.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(parts)
+            parts = []
+            length = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzip_chunks(chunks):
+    """
+    Compress `chunks` as one gzip stream, flushing after each chunk so the
+    client can render the page as it arrives.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def brotli_chunks(chunks):
+    """
+    Compress `chunks` as one brotli stream, flushing after each chunk.
+    """
+    import brotli
+
+    compressor = brotli.Compressor(quality=5)
+    for chunk in chunks:
+        yield compressor.process(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+def make_streamed_response(chunks, encoding, mimetype="text/html"):
+    """
+    Return a response that sends the strings `chunks` as they are generated,
+    compressed with `encoding` (see `choose_encoding()`).
+    """
+    body = group_chunks(chunks)
+    if encoding == "br":
+        body = brotli_chunks(body)
+    elif encoding == "gzip":
+        body = gzip_chunks(body)
+    resp = Response(body, mimetype=mimetype)
+    if encoding is not None:
+        resp.headers["Content-Encoding"] = encoding
+    if is_compression_enabled():
+        resp.vary.add("Accept-Encoding")
+    return resp
@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import OrderedDict
+
+from logzero import logger
+
+from applib.bucket import list_folder, resource_to_bucket_path
+from applib.cache import listing_cache
+from applib.folderstats import annotate_folders
+
+# Sortable columns of the files and folders tables, in display order.
+COLUMNS = ["key", "size", "last_modified"]
+# Maximum number of rows returned per request.
+MAX_PAGE_LENGTH = 1000
+# Filter results kept per table.
+MAX_CACHED_FILTERS = 8
+
+
+class FolderTable:
+    """
+    The files or folders of a folder listing for server-side table
+    processing.  The sort order of each column is computed on first use and
+    kept, as are the results of recent filters, so a request only slices
+    precomputed index lists.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._names = [key.lower() for key in entries.keys]
+        self._orders = {}
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_order(self, column):
+        """
+        Return the entry indices sorted by `column` (ascending), with ties
+        broken by name.
+        """
+        with self._lock:
+            order = self._orders.get(column)
+        if order is not None:
+            return order
+        keys = self.entries.keys
+        if column == "key":
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+        else:
+            values = self.entries.get_column(column)
+            order = sorted(range(len(keys)), key=lambda i: (values[i], keys[i]))
+        with self._lock:
+            self._orders[column] = order
+        return order
+
+    def get_matches(self, column, search):
+        """
+        Return the indices of the entries whose name contains `search`
+        (case-insensitive), sorted by `column`.
+        """
+        order = self.get_order(column)
+        if search == "":
+            return order
+        filter_key = (column, search.lower())
+        with self._lock:
+            matches = self._filters.get(filter_key)
+            if matches is not None:
+                self._filters.move_to_end(filter_key)
+                return matches
+        needle = search.lower()
+        names = self._names
+        matches = [i for i in order if needle in names[i]]
+        with self._lock:
+            self._filters[filter_key] = matches
+            while len(self._filters) > MAX_CACHED_FILTERS:
+                self._filters.popitem(last=False)
+        return matches
+
+    def query(self, column, descending, search, start, length):
+        """
+        Return (number of matching entries, the entries of the page).
+        """
+        matches = self.get_matches(column, search)
+        count = len(matches)
+        stop = min(start + length, count)
+        if descending:
+            page = [matches[count - 1 - n] for n in range(start, stop)]
+        else:
+            page = matches[start:stop]
+        return count, self.entries.take(page)
+
+
+def get_folder_table(bucket_name, bucket_path, kind):
+    """
+    Return the `FolderTable` of the `kind` entries (`files` or `folders`) of
+    the folder `bucket_path`.  Tables are kept in the listing cache and
+    invalidated with the folder.  Folders are sorted by the totals read when
+    the table was built; `query_table()` reads the totals it returns again.
+    """
+    cache_key = (bucket_name, bucket_path, "table", kind)
+    table = listing_cache.get(cache_key)
+    if table is not None:
+        return table
+    objects = list_folder(bucket_name, bucket_path)
+    entries = objects[kind]
+    if kind == "folders":
+        entries = annotate_folders(bucket_path, entries)
+    table = FolderTable(entries)
+    listing_cache.put(cache_key, table)
+    logger.debug("Built %s table of `%s` (%d rows).", kind, bucket_path, len(entries))
+    return table
+
+
+def parse_table_request(args):
+    """
+    Parse the DataTables server-side request parameters in `args`.
+    Returns (draw, column, descending, search, start, length); raises
+    ValueError for invalid parameters.
+    """
+    draw = int(args.get("draw", "0"))
+    start = int(args.get("start", "0"))
+    length = int(args.get("length", "10"))
+    if start < 0:
+        raise ValueError("`start` must not be negative.")
+    if length < 0:
+        # -1 means "all rows".
+        length = MAX_PAGE_LENGTH
+    length = min(length, MAX_PAGE_LENGTH)
+    index = int(args.get("order[0][column]", "0"))
+    if not 0 <= index < len(COLUMNS):
+        raise ValueError("Column {} cannot be sorted.".format(index))
+    column = COLUMNS[index]
+    descending = args.get("order[0][dir]", "asc") == "desc"
+    search = args.get("search[value]", "").strip()
+    return draw, column, descending, search, start, length
+
+
+def query_table(path, kind, args):
+    """
+    Answer a DataTables server-side request for the `kind` table (`files` or
+    `folders`) of the folder at `path`.
+    """
+    bucket_name = os.environ.get("S3_BUCKET")
+    message = "You must provide the environment variable `S3_BUCKET`."
+    assert bucket_name, Exception(message)
+    draw, column, descending, search, start, length = parse_table_request(args)
+    bucket_path = resource_to_bucket_path(path)
+    table = get_folder_table(bucket_name, bucket_path, kind)
+    count, rows = table.query(column, descending, search, start, length)
+    if kind == "folders":
+        # Like `with_folder_totals()`, return current totals.
+        rows = annotate_folders(bucket_path, rows)
+    return {
+        "draw": draw,
+        "recordsTotal": len(table.entries),
+        "recordsFiltered": count,
+        "data": rows,
+    }
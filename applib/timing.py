@@ -0,0 +1,132 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+from applib.clients import config2bool
+
+
+def is_server_timing_enabled():
+    """
+    Should responses carry a `Server-Timing` header?  It shows internal phase
+    durations to every client, so it is off unless `SERVER_TIMING` is set.
+    """
+    return config2bool(os.environ.get("SERVER_TIMING", "false"))
+
+
+def get_metrics_namespace():
+    """
+    Return the CloudWatch namespace for request timing metrics, or None if
+    metrics are disabled.
+    """
+    return os.environ.get("METRICS_NAMESPACE", "S3Browser") or None
+
+
+def init_request_timing(app):
+    """
+    Register the request hooks that report the phases recorded with `timed()`
+    in a `Server-Timing` header and as CloudWatch Embedded Metric Format (EMF)
+    log lines.
+    """
+    app.before_request(start_request_timing)
+    app.after_request(finish_request_timing)
+
+
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.request_phases = []
+
+
+def record_phase(name, started):
+    """
+    Record the phase `name` of the current request as having run from
+    `started` (a `time.perf_counter()` value) until now.
+    """
+    phases = g.get("request_phases")
+    if phases is not None:
+        phases.append((name, (time.perf_counter() - started) * 1000.0))
+
+
+@contextmanager
+def timed(name):
+    """
+    Record the time spent in the `with` block as the phase `name` of the
+    current request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, started)
+
+
+async def timed_await(name, awaitable):
+    """
+    Await `awaitable` and record the time taken as the phase `name`.  Phases
+    awaited together with `asyncio.gather()` overlap.
+    """
+    with timed(name):
+        return await awaitable
+
+
+def finish_request_timing(resp):
+    # Streamed bodies are generated after this runs, so their phases and
+    # `total` stop when the headers are sent.
+    phases = g.get("request_phases")
+    if not phases:
+        return resp
+    total = (time.perf_counter() - g.request_started) * 1000.0
+    phases = phases + [("total", total)]
+    if is_server_timing_enabled():
+        resp.headers["Server-Timing"] = make_server_timing(phases)
+    namespace = get_metrics_namespace()
+    if namespace is not None:
+        emit_metrics(namespace, request.endpoint, phases, resp.status_code)
+    return resp
+
+
+def make_server_timing(phases):
+    """
+    Format `(name, milliseconds)` phases as a `Server-Timing` header value.
+    """
+    return ", ".join("{};dur={:.1f}".format(name, ms) for name, ms in phases)
+
+
+def make_emf_record(namespace, endpoint, phases, status_code):
+    """
+    Return an Embedded Metric Format record with one metric per phase,
+    dimensioned by endpoint.  See
+    https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [["Endpoint"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": "Milliseconds"} for name, _ in phases
+                    ],
+                }
+            ],
+        },
+        "Endpoint": endpoint,
+        "StatusCode": status_code,
+    }
+    for name, ms in phases:
+        record[name] = round(ms, 3)
+    return record
+
+
+def emit_metrics(namespace, endpoint, phases, status_code):
+    """
+    Write an EMF record to STDOUT, where Lambda forwards it to CloudWatch
+    Logs as a single line of JSON.
+    """
+    record = make_emf_record(namespace, endpoint, phases, status_code)
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
@@ -0,0 +1,177 @@
+import math
+import os
+
+from logzero import logger
+
+from applib.aws import get_bucket_root_prefix
+from applib.bucket import invalidate_listings
+from applib.clients import get_client
+from applib.folderstats import get_object_size, record_file_change
+
+# S3 multipart upload limits.
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# Maximum number of part URLs signed per request.
+MAX_SIGNED_PARTS = 100
+
+
+def get_part_size(size):
+    """
+    Return the part size to use for an object of `size` bytes.
+    """
+    part_size = int(os.environ.get("UPLOAD_PART_SIZE", str(16 * 1024 * 1024)))
+    part_size = max(part_size, MIN_PART_SIZE)
+    if size is not None:
+        part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    return part_size
+
+
+def get_upload_url_expiration():
+    """
+    Return the lifetime of presigned part URLs in seconds.
+    """
+    return int(os.environ.get("UPLOAD_URL_EXPIRES", "3600"))
+
+
+def is_valid_upload_key(key):
+    """
+    Can a file be uploaded to `key`?
+    """
+    if not isinstance(key, str) or key == "" or key.endswith("/"):
+        return False
+    return key.startswith(get_bucket_root_prefix())
+
+
+def create_multipart_upload(key, size=None):
+    """
+    Start a multipart upload for `key`.
+    Returns the upload ID and the part size the client should use.
+    """
+    if not is_valid_upload_key(key):
+        return "Forbidden", 403
+    bucket_name = os.environ.get("S3_BUCKET")
+    part_size = get_part_size(size)
+    client = get_client("s3")
+    resp = client.create_multipart_upload(Bucket=bucket_name, Key=key)
+    upload_id = resp["UploadId"]
+    logger.info("Started multipart upload for `{}`.".format(key))
+    result = {"key": key, "upload_id": upload_id, "part_size": part_size}
+    if size is not None:
+        result["part_count"] = max(1, math.ceil(size / part_size))
+    return result
+
+
+def sign_upload_parts(key, upload_id, part_numbers):
+    """
+    Return presigned `UploadPart` URLs for `part_numbers`, keyed by part
+    number.  Failed parts can be re-signed and retried individually.
+    """
+    if not is_valid_upload_key(key):
+        return "Forbidden", 403
+    if upload_id is None or len(part_numbers) == 0:
+        return "Bad Request", 400
+    if len(part_numbers) > MAX_SIGNED_PARTS:
+        return "Bad Request", 400
+    for part_number in part_numbers:
+        if not isinstance(part_number, int) or not 1 <= part_number <= MAX_PARTS:
+            return "Bad Request", 400
+    bucket_name = os.environ.get("S3_BUCKET")
+    expires = get_upload_url_expiration()
+    client = get_client("s3")
+    urls = {}
+    for part_number in part_numbers:
+        urls[str(part_number)] = client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": bucket_name,
+                "Key": key,
+                "UploadId": upload_id,
+                "PartNumber": part_number,
+            },
+            ExpiresIn=expires,
+        )
+    return {"urls": urls, "expires_in": expires}
+
+
+def list_uploaded_parts(bucket_name, key, upload_id):
+    """
+    Return the parts S3 has received for an upload, in order.
+    """
+    client = get_client("s3")
+    paginator = client.get_paginator("list_parts")
+    parts = []
+    for page in paginator.paginate(Bucket=bucket_name, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts.append({"PartNumber": part["PartNumber"], "ETag": part["ETag"]})
+    parts.sort(key=lambda part: part["PartNumber"])
+    return parts
+
+
+def complete_multipart_upload(key, upload_id):
+    """
+    Complete a multipart upload from the parts S3 has received.
+    """
+    if not is_valid_upload_key(key):
+        return "Forbidden", 403
+    if upload_id is None:
+        return "Bad Request", 400
+    bucket_name = os.environ.get("S3_BUCKET")
+    parts = list_uploaded_parts(bucket_name, key, upload_id)
+    if len(parts) == 0:
+        return "No parts have been uploaded.", 400
+    client = get_client("s3")
+    resp = client.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": parts},
+    )
+    logger.info(
+        "Completed multipart upload for `{}` with {} parts.".format(key, len(parts))
+    )
+    invalidate_listings(bucket_name, key)
+    record_new_file(bucket_name, key)
+    return {"key": key, "etag": resp.get("ETag"), "parts": len(parts)}
+
+
+def record_upload(key):
+    """
+    Record that the browser uploaded `key` directly to S3 (without a
+    multipart upload session), so listings that are cached or answered from
+    the inventory index pick it up.
+    """
+    if not is_valid_upload_key(key):
+        return "Forbidden", 403
+    bucket_name = os.environ.get("S3_BUCKET")
+    invalidate_listings(bucket_name, key)
+    record_new_file(bucket_name, key)
+    return {"key": key}
+
+
+def record_new_file(bucket_name, key):
+    """
+    Add a new file to the folder totals.  An overwritten file is counted
+    again until the totals are recomputed.
+    """
+    size = get_object_size(bucket_name, key)
+    if size is not None:
+        record_file_change(key, size, 1)
+
+
+def abort_multipart_upload(key, upload_id):
+    """
+    Abort a multipart upload and discard its parts.
+    """
+    if not is_valid_upload_key(key):
+        return "Forbidden", 403
+    if upload_id is None:
+        return "Bad Request", 400
+    bucket_name = os.environ.get("S3_BUCKET")
+    client = get_client("s3")
+    resp = client.abort_multipart_upload(
+        Bucket=bucket_name, Key=key, UploadId=upload_id
+    )
+    logger.info("Aborted multipart upload for `{}`.".format(key))
+    meta = resp["ResponseMetadata"]
+    http_status = meta["HTTPStatusCode"]
+    return "Response Status", http_status
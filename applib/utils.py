@@ -1,10 +1,15 @@
-import logging
+import hashlib
+import json
 import os
 
-import boto3
 from flask_talisman import Talisman
 from logzero import logger
 
+from applib.listing import ListingJSONProvider
+from applib.logutil import init_logging
+from applib.secretcache import get_secret_cache
+from applib.sessions import make_session_interface
+from applib.timing import init_request_timing
 from applib.websecurity import create_content_security_policy
 
 
@@ -22,29 +27,27 @@ def init_flask_app(app):
     Initialize the Flask app.
     """
     # Configure logging.
-    logging.basicConfig(
-        level=getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper())
-    )
+    init_logging()
     # Enable web security headers when not in development mode.
     if not is_dev_env():
         Talisman(app, content_security_policy=create_content_security_policy())
-    # Set the secret key to some random bytes. Keep this really secret!
-    secret_name = os.environ["APP_SECRET"]
-    app.secret_key = get_secret_string(secret_name)
+    # The secret key is fetched from Secrets Manager when a session is first
+    # opened rather than at import time; see `applib.sessions`.
+    app.session_interface = make_session_interface()
+    # Report per-phase timings; see `applib.timing`.
+    init_request_timing(app)
+    # Serialize compact listings; see `applib.listing`.
+    app.json = ListingJSONProvider(app)
 
 
-def get_secret_string(secret_name, region="us-east-1"):
+def get_secret_string(secret_name, region=None):
     """
     Get secret string by name.
+    Values are cached; see `applib.secretcache`.
     """
-    session = boto3.session.Session()
-    client = session.client(
-        service_name="secretsmanager",
-        region_name=region,
-    )
-    get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-    secret = get_secret_value_response["SecretString"]
-    return secret
+    if region is None:
+        region = os.environ.get("AWS_REGION")
+    return get_secret_cache(secret_name, region=region).get()
 
 
 def make_path_components(subpath):
@@ -59,3 +62,37 @@ def make_path_components(subpath):
         full_path = "/".join(parts[:pos])
         path_components.append((component, full_path))
     return path_components
+
+
+_template_digests = {}
+
+
+def get_template_digest(app, *names):
+    """
+    Return a digest of the sources of the templates `names`, so that page
+    ETags change when new templates are deployed.
+    """
+    digest = _template_digests.get(names)
+    if digest is None:
+        h = hashlib.blake2b(digest_size=8)
+        for name in names:
+            source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+            h.update(source.encode("utf-8"))
+        digest = h.hexdigest()
+        _template_digests[names] = digest
+    return digest
+
+
+def make_listing_etag(objects, *context):
+    """
+    Return an ETag for a page that shows the listing `objects` and otherwise
+    depends only on `context` (JSON-serializable values).  Keys, sizes and
+    modification times of the entries are hashed; nothing is rendered.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(context, default=str).encode("utf-8"))
+    h.update(str(objects.get("cursor")).encode("utf-8"))
+    for kind in ("folders", "files"):
+        h.update(kind.encode("utf-8"))
+        objects[kind].update_hash(h)
+    return h.hexdigest()
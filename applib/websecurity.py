@@ -1,5 +1,8 @@
 import os
 
+from flask import current_app, session
+from flask_wtf.csrf import generate_csrf
+
 
 def create_content_security_policy():
     """
@@ -15,7 +18,6 @@ def create_content_security_policy():
             "'self'",
             "'unsafe-eval'",
             "cdn.datatables.net",
-            "cdn.jsdelivr.net",
             "cdnjs.cloudflare.com",
             "code.jquery.com",
             "maxcdn.bootstrapcdn.com",
@@ -36,9 +38,21 @@ def create_content_security_policy():
         "connect-src": [
             "'self'",
             "{}.s3.{}.amazonaws.com".format(bucket_name, aws_region),
+            # Presigned URLs may use the global endpoint.
+            "{}.s3.amazonaws.com".format(bucket_name),
         ],
         "frame-src": [
             "'self'",
         ],
     }
     return csp
+
+
+def get_csrf_session_secret():
+    """
+    Return the per-session secret that CSRF tokens are derived from,
+    creating it if needed.  It changes with each new session, so it can
+    version responses that embed a CSRF token.
+    """
+    generate_csrf()
+    return session[current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")]
@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+
+"""
+ASGI entry point.  Serves the application with async views for browsing,
+deleting, creating folders and the credentials script:
+
+    uvicorn asgi:application
+
+Requires `asgiref` and an ASGI server such as `uvicorn`; AWS calls use
+`aiobotocore` if it is installed.  Requests run on a pool of
+`ASGI_THREADS` threads.  While a view waits for AWS, its calls run on the
+server's event loop, so many requests can be waiting at once.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app, use_async_views
+
+
+def get_asgi_threads():
+    """
+    Return the number of requests that are handled at once.
+    """
+    return max(1, int(os.environ.get("ASGI_THREADS", "64")))
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    def __init__(self, wsgi_application, executor, duplicate_header_limit=100):
+        super().__init__(wsgi_application, duplicate_header_limit)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # `asgiref` runs every WSGI request on one shared thread; use the
+        # pool instead.  Not the loop's default executor: that one resolves
+        # host names for aiobotocore and must not be filled by requests.
+        run = sync_to_async(
+            WsgiToAsgiInstance.run_wsgi_app.__wrapped__,
+            thread_sensitive=False,
+            executor=self.executor,
+        )
+        await run(self, body)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """
+    Serve a WSGI application over ASGI with requests on a thread pool.
+    """
+
+    def __init__(self, wsgi_application, threads):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="asgi"
+        )
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(
+            self.wsgi_application, self.executor, self.duplicate_header_limit
+        )(scope, receive, send)
+
+
+use_async_views()
+application = ThreadedWsgiToAsgi(app, get_asgi_threads())
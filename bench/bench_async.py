@@ -0,0 +1,405 @@
+#! /usr/bin/env python
+
+"""
+Load-test the browse page served over WSGI (blocking views) and over ASGI
+(`asgi.py`, async views) against a local stub of S3, STS and Secrets Manager
+that answers after a fixed delay.
+
+Each server runs in its own process with the same number of request threads.
+Every request lists a folder and assumes a role (the credentials cache is
+defeated), so the ASGI server can overlap the two calls.  Reports requests per
+second and latency percentiles as JSON.
+
+Requires `asgiref` and `uvicorn` (`pip install asgiref uvicorn`).
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_DIR)
+
+BUCKET = "s3browser-bench"
+BUCKET_ROOT = "root"
+
+DEV_IDENTITY = {
+    "sub": "bench",
+    "family_name": "Bench",
+    "given_name": "Mark",
+    "permissions": {
+        "list_files": True,
+        "download_file": True,
+        "upload_file": True,
+    },
+}
+
+LIST_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+<Name>{bucket}</Name><Prefix>{prefix}</Prefix><KeyCount>{count}</KeyCount>
+<MaxKeys>1000</MaxKeys><Delimiter>/</Delimiter><EncodingType>url</EncodingType>
+<IsTruncated>false</IsTruncated>
+{contents}
+</ListBucketResult>
+"""
+
+LIST_ENTRY = (
+    "<Contents><Key>{key}</Key><LastModified>2024-01-01T00:00:00.000Z"
+    "</LastModified><ETag>&quot;0&quot;</ETag><Size>{size}</Size>"
+    "<StorageClass>STANDARD</StorageClass></Contents>"
+)
+
+ASSUME_ROLE_RESPONSE = """<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+<AssumeRoleResult><Credentials>
+<AccessKeyId>ASIABENCH</AccessKeyId><SecretAccessKey>bench</SecretAccessKey>
+<SessionToken>bench</SessionToken><Expiration>{expiration}</Expiration>
+</Credentials><AssumedRoleUser>
+<Arn>arn:aws:sts::123456789012:assumed-role/s3browser-bench/bench</Arn>
+<AssumedRoleId>AROABENCH:bench</AssumedRoleId>
+</AssumedRoleUser></AssumeRoleResult>
+<ResponseMetadata><RequestId>bench</RequestId></ResponseMetadata>
+</AssumeRoleResponse>
+"""
+
+
+class StubAWSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    files = 0
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        time.sleep(StubAWSHandler.delay)
+        query = parse_qs(urlsplit(self.path).query)
+        prefix = query.get("prefix", [""])[0]
+        contents = "\n".join(
+            LIST_ENTRY.format(key=quote("{}file-{}.txt".format(prefix, n)), size=n)
+            for n in range(StubAWSHandler.files)
+        )
+        body = LIST_RESPONSE.format(
+            bucket=BUCKET,
+            prefix=quote(prefix),
+            count=StubAWSHandler.files,
+            contents=contents,
+        )
+        self.respond(body.encode("utf-8"), "application/xml")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        self.rfile.read(length)
+        target = self.headers.get("X-Amz-Target", "")
+        if target.startswith("secretsmanager."):
+            body = {
+                "ARN": "arn:aws:secretsmanager:us-east-1:123456789012:secret:bench",
+                "Name": "bench",
+                "SecretString": "s3browser-bench-secret",
+                "VersionId": "bench",
+            }
+            self.respond(json.dumps(body).encode("utf-8"), "application/x-amz-json-1.1")
+            return
+        time.sleep(StubAWSHandler.delay)
+        # Credentials that are already inside the refresh margin, so that
+        # every request assumes the role.
+        expiration = datetime.now(timezone.utc) + timedelta(seconds=900)
+        body = ASSUME_ROLE_RESPONSE.format(
+            expiration=expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+        )
+        self.respond(body.encode("utf-8"), "text/xml")
+
+    def respond(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(delay, files):
+    """
+    Start the stub AWS server in a background thread and return it.
+    """
+    StubAWSHandler.delay = delay
+    StubAWSHandler.files = files
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAWSHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def make_server_environment(endpoint, identity_path, threads):
+    """
+    Return the environment of an application server pointed at the stub.
+    """
+    env = dict(os.environ)
+    env.update(
+        {
+            "AWS_ENDPOINT_URL": endpoint,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_REGION": "us-east-1",
+            "AWS_MAX_POOL_CONNECTIONS": str(threads * 2),
+            "AWS_ASYNC_WORKERS": str(threads * 2),
+            "ASGI_THREADS": str(threads),
+            "S3_BUCKET": BUCKET,
+            "BUCKET_ROOT": BUCKET_ROOT,
+            "APP_SECRET": "s3browser-bench-secret",
+            "APP_DEV_IDENTITY": identity_path,
+            "FLASK_ENV": "development",
+            "LOG_LEVEL": "WARNING",
+            "METRICS_NAMESPACE": "",
+            "S3_ROLE_ARN": "arn:aws:iam::123456789012:role/s3browser-bench",
+            "UPLOAD_POLICY_ARN": "arn:aws:iam::123456789012:policy/upload",
+            # Assume the role and list S3 on every request.
+            "AWS_CREDENTIALS_MARGIN": "900",
+            "LISTING_CACHE_SIZE": "0",
+        }
+    )
+    return env
+
+
+def serve_wsgi(port, threads):
+    """
+    Serve `app.py` with a fixed pool of request threads, like a WSGI server
+    with synchronous workers.
+    """
+    from werkzeug.serving import BaseWSGIServer
+
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    class PooledWSGIServer(BaseWSGIServer):
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, app).serve_forever()
+
+
+def serve_asgi(port):
+    import uvicorn
+
+    uvicorn.run("asgi:application", host="127.0.0.1", port=port, log_level="warning")
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app_server(mode, env, threads):
+    """
+    Start an application server process and wait until it accepts
+    connections.  Returns (process, base URL).
+    """
+    port = get_free_port()
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--serve",
+        mode,
+        "--port",
+        str(port),
+        "--threads",
+        str(threads),
+    ]
+    process = subprocess.Popen(command, cwd=PROJECT_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, "http://127.0.0.1:{}".format(port)
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The {} server did not start.".format(mode))
+
+
+def run_load(url, requests_total, concurrency):
+    """
+    Send `requests_total` GET requests to `url` from `concurrency` clients
+    with keep-alive connections.  Returns throughput and latency statistics.
+    """
+    import requests
+
+    local = threading.local()
+
+    def fetch(_):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        resp = session.get(url)
+        return time.perf_counter() - started, resp.status_code
+
+    # Warm up connections, clients and templates.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fetch, range(concurrency)))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(requests_total)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status != 200)
+    return {
+        "requests": requests_total,
+        "errors": errors,
+        "requests_per_second": requests_total / elapsed,
+        "p50": statistics.median(latencies),
+        "p90": latencies[int(len(latencies) * 0.9)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "max": latencies[-1],
+    }
+
+
+def main(args):
+    if args.serve == "wsgi":
+        serve_wsgi(args.port, args.threads)
+        return
+    if args.serve == "asgi":
+        serve_asgi(args.port)
+        return
+    server = start_stub_server(args.delay, args.files)
+    host, port = server.server_address
+    endpoint = "http://{}:{}".format(host, port)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(DEV_IDENTITY, f)
+        identity_path = f.name
+    results = {}
+    try:
+        env = make_server_environment(endpoint, identity_path, args.threads)
+        for mode in args.mode or ["wsgi", "asgi"]:
+            process, base_url = start_app_server(mode, env, args.threads)
+            try:
+                url = "{}/browse/{}".format(base_url, args.path)
+                results[mode] = run_load(url, args.requests, args.concurrency)
+            finally:
+                process.terminate()
+                process.wait()
+            print(
+                "{:5} {:8.1f} req/s  p50 {:.3f}s  p99 {:.3f}s".format(
+                    mode,
+                    results[mode]["requests_per_second"],
+                    results[mode]["p50"],
+                    results[mode]["p99"],
+                ),
+                file=sys.stderr,
+            )
+    finally:
+        os.remove(identity_path)
+        server.shutdown()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "aws_delay": args.delay,
+            "files": args.files,
+            "threads": args.threads,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load-test WSGI and ASGI serving against a stub AWS."
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        action="append",
+        choices=["wsgi", "asgi"],
+        help="Serving mode to test.  May be repeated.  Default: both.",
+    )
+    parser.add_argument(
+        "-n",
+        "--requests",
+        action="store",
+        type=int,
+        default=1000,
+        help="Requests per serving mode.",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        action="store",
+        type=int,
+        default=32,
+        help="Concurrent clients.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        action="store",
+        type=int,
+        default=8,
+        help="Request threads per server process.",
+    )
+    parser.add_argument(
+        "-d",
+        "--delay",
+        action="store",
+        type=float,
+        default=0.05,
+        help="Seconds the stub waits before answering an S3 or STS call.",
+    )
+    parser.add_argument(
+        "-f",
+        "--files",
+        action="store",
+        type=int,
+        default=50,
+        help="Files in the listed folder.",
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        action="store",
+        default="top",
+        help="Subpath of the browsed folder.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    parser.add_argument("--serve", choices=["wsgi", "asgi"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+
+"""
+Benchmark CAS service ticket validation against a local stub CAS server.
+
+Reports logins per second for `applib.cas.validate_service_ticket` (shared
+keep-alive session, streaming parse) and, for comparison, for a bare
+`requests.get` per login followed by a full-document parse.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+VALIDATION_RESPONSE = """<cas:serviceResponse xmlns:cas="http://www.yale.edu/tp/cas">
+    <cas:authenticationSuccess>
+        <cas:user>bench</cas:user>
+        <cas:attributes>
+            <cas:givenName>Bench</cas:givenName>
+            <cas:sn>Mark</cas:sn>
+{}
+        </cas:attributes>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+ENTITLEMENT = (
+    "            <cas:eduPersonEntitlement>"
+    "https://s3browser.example.net/example_bucket/permissions?list_files=allow"
+    "</cas:eduPersonEntitlement>"
+)
+
+
+class StubCASHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    body = b""
+    delay = 0.0
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        if StubCASHandler.delay > 0:
+            time.sleep(StubCASHandler.delay)
+        body = StubCASHandler.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(attributes, delay):
+    """
+    Start the stub CAS server in a background thread and return it.
+    """
+    entitlements = "\n".join([ENTITLEMENT] * attributes)
+    StubCASHandler.body = VALIDATION_RESPONSE.format(entitlements).encode("utf-8")
+    StubCASHandler.delay = delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCASHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def unpooled_validate(ticket):
+    """
+    Validation as done before pooling: one connection per login and a
+    full-document parse of the decoded text.
+    """
+    import requests
+    from lxml import etree
+
+    params = dict(service=os.environ["CAS_SERVICE_URL"], ticket=ticket)
+    r = requests.get(os.environ["CAS_SERVICE_VALIDATE_URL"], params=params)
+    root = etree.fromstring(r.text.encode("utf-8"), parser=etree.XMLParser())
+    return etree.QName(root[0]).localname == "authenticationSuccess"
+
+
+def pooled_validate(ticket):
+    from applib.cas import validate_service_ticket
+
+    is_valid, _, _ = validate_service_ticket(ticket)
+    return is_valid
+
+
+def run(validate, logins, concurrency):
+    """
+    Run `logins` validations on `concurrency` threads.
+    Returns logins per second.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(
+            executor.map(validate, ["ST-{}".format(n) for n in range(logins)])
+        )
+    elapsed = time.perf_counter() - start
+    assert all(results), "Some validations failed."
+    return logins / elapsed
+
+
+def main(args):
+    server = start_stub_server(args.attributes, args.delay)
+    host, port = server.server_address
+    os.environ["CAS_SERVICE_VALIDATE_URL"] = (
+        "http://{}:{}/cas/p3/serviceValidate".format(host, port)
+    )
+    os.environ["CAS_SERVICE_URL"] = "https://s3browser.example.net/login"
+    # Warm up imports.
+    run(pooled_validate, 2, 1)
+    run(unpooled_validate, 2, 1)
+    results = {
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "attributes": args.attributes,
+        "server_delay": args.delay,
+        "pooled_logins_per_second": run(pooled_validate, args.logins, args.concurrency),
+        "unpooled_logins_per_second": run(
+            unpooled_validate, args.logins, args.concurrency
+        ),
+    }
+    server.shutdown()
+    print(json.dumps(results, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark CAS ticket validation against a stub server."
+    )
+    parser.add_argument(
+        "-n", "--logins", action="store", type=int, default=500, help="Logins to run."
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        action="store",
+        type=int,
+        default=4,
+        help="Concurrent logins.",
+    )
+    parser.add_argument(
+        "-a",
+        "--attributes",
+        action="store",
+        type=int,
+        default=20,
+        help="Entitlement attributes in each validation response.",
+    )
+    parser.add_argument(
+        "-d",
+        "--delay",
+        action="store",
+        type=float,
+        default=0.0,
+        help="Seconds the stub server waits before responding.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+
+"""
+Micro-benchmark: a new boto3 client per request versus the shared client
+registry in `applib.clients`.
+
+A local HTTP server stands in for S3 so that the numbers only reflect client
+construction and connection handling, not network latency to AWS.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+LIST_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+<Name>bench</Name><Prefix></Prefix><KeyCount>0</KeyCount><MaxKeys>1000</MaxKeys>
+<Delimiter>/</Delimiter><IsTruncated>false</IsTruncated>
+</ListBucketResult>"""
+
+
+class StubS3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def setup(self):
+        super().setup()
+        # Avoid Nagle/delayed-ACK stalls on reused connections.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        StubS3Handler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(LIST_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(LIST_RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    """
+    Start the stub S3 server in a background thread and return it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubS3Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run_requests(get_client, iterations):
+    """
+    Time `iterations` simulated requests that each obtain a client and list
+    the bucket once.  Returns seconds per request.
+    """
+    StubS3Handler.connections.clear()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client = get_client()
+        client.list_objects_v2(Bucket="bench", Delimiter="/", Prefix="")
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations, len(StubS3Handler.connections)
+
+
+def main(args):
+    server = start_stub_server()
+    host, port = server.server_address
+    os.environ["AWS_ENDPOINT_URL"] = "http://{}:{}".format(host, port)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    import boto3
+
+    from applib.clients import get_client, reset_clients
+
+    def new_client():
+        return boto3.client("s3")
+
+    def shared_client():
+        return get_client("s3")
+
+    # Warm up imports and botocore's loader caches.
+    run_requests(new_client, 2)
+    reset_clients()
+    per_request_new, connections_new = run_requests(new_client, args.iterations)
+    per_request_shared, connections_shared = run_requests(
+        shared_client, args.iterations
+    )
+    server.shutdown()
+    results = {
+        "iterations": args.iterations,
+        "new_client": {
+            "seconds_per_request": per_request_new,
+            "connections": connections_new,
+        },
+        "shared_client": {
+            "seconds_per_request": per_request_shared,
+            "connections": connections_shared,
+        },
+        "saving_per_request_ms": (per_request_new - per_request_shared) * 1000,
+    }
+    print(json.dumps(results, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare per-request boto3 clients with shared clients."
+    )
+    parser.add_argument(
+        "-n",
+        "--iterations",
+        action="store",
+        type=int,
+        default=200,
+        help="Number of simulated requests.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    args = parser.parse_args()
+    main(args)
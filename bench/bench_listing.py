@@ -0,0 +1,318 @@
+#! /usr/bin/env python
+
+"""
+Benchmark listing, path mapping and page rendering at scale.
+
+Fills an in-process S3 stand-in (moto) with synthetic layouts and measures
+`list_bucket_objects`, `resource_to_bucket_path`, `make_path_components`,
+and rendering of `browse.jinja2` through the Flask test client.  Results are
+written as JSON so runs can be compared.
+
+Requires `moto` (`pip install moto`).  Populating the larger layouts takes a
+while; pick layouts with `--layout`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_DIR)
+
+BUCKET = "s3browser-bench"
+BUCKET_ROOT = "root"
+
+# Synthetic layouts; each is created under `<BUCKET_ROOT>/<name>/`.
+LAYOUTS = {
+    "flat-10k": {"kind": "flat", "files": 10000},
+    "flat-100k": {"kind": "flat", "files": 100000},
+    "flat-1m": {"kind": "flat", "files": 1000000},
+    "deep": {"kind": "deep", "depth": 5, "fanout": 4, "files": 5},
+}
+
+DEV_IDENTITY = {
+    "sub": "bench",
+    "family_name": "Bench",
+    "given_name": "Mark",
+    "permissions": {
+        "list_files": True,
+        "create_folder": True,
+        "remove_folder": True,
+        "download_file": True,
+        "upload_file": True,
+        "remove_file": True,
+    },
+}
+
+
+def configure_environment(identity_path):
+    """
+    Set the settings the application reads, pointing it at moto.
+    """
+    os.environ.update(
+        {
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_REGION": "us-east-1",
+            "S3_BUCKET": BUCKET,
+            "BUCKET_ROOT": BUCKET_ROOT,
+            "APP_SECRET": "s3browser-bench-secret",
+            "APP_DEV_IDENTITY": identity_path,
+            "FLASK_ENV": "development",
+            "LOG_LEVEL": "WARNING",
+            "S3_ROLE_ARN": "arn:aws:iam::123456789012:role/s3browser-bench",
+            "UPLOAD_POLICY_ARN": "arn:aws:iam::123456789012:policy/upload",
+            # Measure S3 listing, not the listing cache.
+            "LISTING_CACHE_SIZE": "0",
+        }
+    )
+
+
+def generate_keys(name, layout):
+    """
+    Generate the keys of a layout under `<BUCKET_ROOT>/<name>/`.
+    """
+    prefix = "{}/{}/".format(BUCKET_ROOT, name)
+    if layout["kind"] == "flat":
+        for n in range(layout["files"]):
+            yield "{}file-{:07d}.dat".format(prefix, n)
+        return
+
+    def walk(folder, depth):
+        for n in range(layout["files"]):
+            yield "{}file-{}.dat".format(folder, n)
+        if depth == 0:
+            return
+        for n in range(layout["fanout"]):
+            yield from walk("{}dir-{}/".format(folder, n), depth - 1)
+
+    yield from walk(prefix, layout["depth"])
+
+
+def populate(client, name, layout, workers):
+    """
+    Upload the (empty) objects of a layout.  Returns the number of keys.
+    """
+    keys = list(generate_keys(name, layout))
+
+    def put(key):
+        client.put_object(Bucket=BUCKET, Key=key, Body=b"")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(put, keys))
+    return len(keys)
+
+
+def measure(func, repeat):
+    """
+    Call `func` `repeat` times and return timing statistics in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def make_subpaths(name, layout):
+    """
+    Return web subpaths (`top/...`) of the folders of a layout, deepest last.
+    """
+    subpaths = ["top/{}".format(name)]
+    if layout["kind"] == "deep":
+        path = subpaths[0]
+        for _ in range(layout["depth"]):
+            path = "{}/dir-0".format(path)
+            subpaths.append(path)
+    return subpaths
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    import boto3
+    import logzero
+
+    from applib.bucket import list_bucket_objects, resource_to_bucket_path
+    from applib.utils import make_path_components
+
+    # Per-key debug logging would dominate the timings.
+    logzero.loglevel(logging.WARNING)
+    client = boto3.client("s3")
+    client.create_bucket(Bucket=BUCKET)
+    boto3.client("secretsmanager").create_secret(
+        Name=os.environ["APP_SECRET"], SecretString="bench"
+    )
+    import app as appmod
+
+    test_client = appmod.app.test_client()
+    environ = {"REMOTE_ADDR": "127.0.0.1"}
+    results = []
+
+    def record(layout_name, benchmark, stats, **extra):
+        entry = {"layout": layout_name, "benchmark": benchmark}
+        entry.update(extra)
+        entry.update(stats)
+        results.append(entry)
+        print(
+            "{:10} {:28} median {:.6f}s".format(
+                layout_name, benchmark, stats["median"]
+            ),
+            file=sys.stderr,
+        )
+
+    for name in args.layout:
+        layout = LAYOUTS[name]
+        start = time.perf_counter()
+        key_count = populate(client, name, layout, args.workers)
+        print(
+            "Populated `{}` with {} keys in {:.1f}s.".format(
+                name, key_count, time.perf_counter() - start
+            ),
+            file=sys.stderr,
+        )
+        subpaths = make_subpaths(name, layout)
+        for subpath in subpaths:
+            record(
+                name,
+                "list_bucket_objects",
+                measure(lambda: list_bucket_objects(subpath), args.repeat),
+                subpath=subpath,
+                keys=key_count,
+            )
+
+            def render():
+                resp = test_client.get(
+                    "/browse/{}".format(subpath), environ_base=environ
+                )
+                assert resp.status_code == 200, resp.status_code
+                return resp.data
+
+            record(
+                name,
+                "render_browse",
+                measure(render, args.repeat),
+                subpath=subpath,
+                bytes=len(render()),
+            )
+        # Path helpers are called once per request; measure a batch.
+        batch = subpaths * max(1, args.batch // len(subpaths))
+        record(
+            name,
+            "resource_to_bucket_path",
+            measure(lambda: [resource_to_bucket_path(p) for p in batch], args.repeat),
+            calls=len(batch),
+        )
+        record(
+            name,
+            "make_path_components",
+            measure(lambda: [make_path_components(p) for p in batch], args.repeat),
+            calls=len(batch),
+        )
+    return results
+
+
+def main(args):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("This benchmark requires `moto`: pip install moto", file=sys.stderr)
+        sys.exit(1)
+    import moto
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(DEV_IDENTITY, f)
+        identity_path = f.name
+    try:
+        configure_environment(identity_path)
+        with mock_aws():
+            results = run_benchmarks(args)
+    finally:
+        os.remove(identity_path)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": get_git_revision(),
+            "python": platform.python_version(),
+            "moto": moto.__version__,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark listing and rendering against moto."
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        action="append",
+        choices=sorted(LAYOUTS),
+        help="Layout to benchmark.  May be repeated.  Default: flat-10k, deep.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        type=int,
+        default=5,
+        help="Repetitions of each measurement.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store",
+        type=int,
+        default=10000,
+        help="Calls per path helper measurement.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        default=8,
+        help="Threads used to populate the bucket.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    args = parser.parse_args()
+    if not args.layout:
+        args.layout = ["flat-10k", "deep"]
+    main(args)
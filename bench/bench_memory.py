@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+
+"""
+Benchmark the memory use of folder listings.
+
+Builds the listing of a synthetic flat folder from `ListObjectsV2` pages
+twice: as one dict per entry with a preformatted timestamp (the former
+representation), and as the compact `applib.listing.EntryList` the app now
+uses.  Reports the memory retained by each listing (measured with
+`tracemalloc`), the time to build it, and the time to read every field of
+every entry as the browse template does.  Results are written as JSON so
+runs can be compared.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote_plus
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, PROJECT_DIR)
+
+PREFIX = "root/bench/"
+
+
+def make_pages(count, page_size=1000):
+    """
+    Return `ListObjectsV2` responses listing `count` files below `PREFIX`.
+    """
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    pages = []
+    for offset in range(0, count, page_size):
+        contents = [
+            {
+                "Key": "{}file-{:08d}.dat".format(PREFIX, n),
+                "LastModified": start + timedelta(seconds=n, milliseconds=n % 1000),
+                "Size": n * 37 % 10000000,
+            }
+            for n in range(offset, min(offset + page_size, count))
+        ]
+        pages.append({"Contents": contents, "CommonPrefixes": []})
+    return pages
+
+
+def build_dicts(pages):
+    """
+    Build the listing as one dict per file, as before `EntryList`.
+    """
+    prefix_len = len(PREFIX)
+    files = []
+    for response in pages:
+        for item in response["Contents"]:
+            key = unquote_plus(item["Key"])[prefix_len:]
+            files.append(
+                {
+                    "key": key,
+                    "last_modified": item["LastModified"].isoformat(),
+                    "size": item["Size"],
+                }
+            )
+    return files
+
+
+def build_compact(pages):
+    """
+    Build the listing with the app's `parse_listing_page()`.
+    """
+    from applib.bucket import parse_listing_page
+    from applib.listing import EntryList
+
+    files = EntryList()
+    for response in pages:
+        page_files, _ = parse_listing_page(response, PREFIX)
+        files.extend(page_files)
+    return files
+
+
+def read_all(files):
+    """
+    Read every field of every entry, like rendering the files table.
+    """
+    total = 0
+    for item in files:
+        total += len(item["key"]) + item["size"] + len(item["last_modified"])
+    return total
+
+
+def measure(build, pages, repeat):
+    """
+    Return the retained bytes, build time and read time of a listing.
+    """
+    # Import and warm up outside of the measurement.
+    build(pages[:1])
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    files = build(pages)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del files
+    build_times = []
+    read_times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        files = build(pages)
+        build_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        read_all(files)
+        read_times.append(time.perf_counter() - start)
+        del files
+    return {
+        "entries": sum(len(page["Contents"]) for page in pages),
+        "retained_bytes": retained,
+        "build_seconds": min(build_times),
+        "read_seconds": min(read_times),
+    }
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    import logzero
+
+    logzero.loglevel(logging.WARNING)
+    results = []
+    for count in args.entries:
+        pages = make_pages(count)
+        for name, build in (("dicts", build_dicts), ("compact", build_compact)):
+            stats = measure(build, pages, args.repeat)
+            stats["representation"] = name
+            stats["bytes_per_entry"] = round(stats["retained_bytes"] / count, 1)
+            results.append(stats)
+            print(
+                "{:8} {:>9} entries {:8.1f} MiB {:7.1f} B/entry "
+                "build {:.3f}s read {:.3f}s".format(
+                    name,
+                    count,
+                    stats["retained_bytes"] / 2**20,
+                    stats["bytes_per_entry"],
+                    stats["build_seconds"],
+                    stats["read_seconds"],
+                ),
+                file=sys.stderr,
+            )
+        del pages
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": get_git_revision(),
+            "python": platform.python_version(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the memory use of folder listings."
+    )
+    parser.add_argument(
+        "-n",
+        "--entries",
+        action="append",
+        type=int,
+        help="Files in the listed folder.  May be repeated.  "
+        "Default: 100000, 1000000.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        type=int,
+        default=3,
+        help="Repetitions of the timings.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    args = parser.parse_args()
+    if not args.entries:
+        args.entries = [100000, 1000000]
+    main(args)
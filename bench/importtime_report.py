@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+"""
+Report the import-time (cold start) cost of the application.
+
+Runs `python -X importtime -c "import app"` in a subprocess and summarizes
+the output as JSON, so the numbers can be compared across releases.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Settings read while the app module is imported.  Real values are not
+# needed because no AWS call is made at import time.
+DEFAULT_ENV = {
+    "APP_SECRET": "importtime",
+    "AWS_REGION": "us-east-1",
+    "S3_BUCKET": "importtime",
+}
+
+
+def run_importtime(module):
+    """
+    Import `module` in a fresh interpreter and return the raw
+    `-X importtime` report lines.
+    """
+    env = dict(DEFAULT_ENV)
+    env.update(os.environ)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=PROJECT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return proc.stderr.splitlines()
+
+
+def parse_importtime(lines):
+    """
+    Parse `-X importtime` lines into a list of
+    (module, self_us, cumulative_us, depth) tuples.
+    """
+    records = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        if not self_us.strip().isdigit():
+            # Header line.
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return records
+
+
+def main(args):
+    records = parse_importtime(run_importtime(args.module))
+    total_us = sum(r[1] for r in records)
+    # Imports nested below the top-level module, slowest first.
+    nested = [r for r in records if r[3] > 0]
+    nested.sort(key=lambda r: r[2], reverse=True)
+    report = {
+        "module": args.module,
+        "python": sys.version.split()[0],
+        "total_us": total_us,
+        "module_count": len(records),
+        "slowest": [
+            {"module": name, "self_us": self_us, "cumulative_us": cumulative_us}
+            for name, self_us, cumulative_us, _ in nested[: args.top]
+        ],
+        "loaded": sorted(
+            name for name in args.watch if any(r[0] == name for r in records)
+        ),
+    }
+    print(json.dumps(report, indent=4), file=args.outfile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import-time cost.")
+    parser.add_argument(
+        "-m", "--module", action="store", default="app", help="Module to import."
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        action="store",
+        type=int,
+        default=20,
+        help="Number of slowest imports to report.",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="append",
+        default=["boto3", "botocore", "lxml", "requests"],
+        help="Report whether this module was imported.  May be repeated.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        type=argparse.FileType("w"),
+        default=sys.stdout,
+        help="Output file.  Use `-` for STDOUT.",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -5,8 +5,9 @@ import sys
 
 import toml
 from awacs.aws import Action, Allow, PolicyDocument, Principal, Statement
-from troposphere import GetAtt, Ref, Template
+from troposphere import GetAtt, Output, Ref, Template
 from troposphere import cloudwatch as cw
+from troposphere import dynamodb
 from troposphere import logs as cwlogs
 from troposphere import sns
 from troposphere.iam import ManagedPolicy, Role
@@ -132,31 +133,6 @@ def make_s3_upload_policy(t, config, role):
     return policy
 
 
-def make_s3_download_policy(t, config, role):
-    """
-    Create policy that will be used to grant download permissions.
-    """
-    bucket_resource = get_bucket_policy_resource(config)
-    policy = ManagedPolicy(
-        "S3DownloadPolicy",
-        PolicyDocument=PolicyDocument(
-            Version="2012-10-17",
-            Statement=[
-                Statement(
-                    Effect=Allow,
-                    Action=[
-                        Action("s3", "GetObject"),
-                    ],
-                    Resource=[bucket_resource],
-                ),
-            ],
-        ),
-        Roles=[Ref(role)],
-    )
-    t.add_resource(policy)
-    return policy
-
-
 def make_lambda_exec_role(t):
     role = Role(
         "LambdaExecRole",
@@ -181,7 +157,38 @@ def make_lambda_exec_role(t):
     return role
 
 
-def make_lambda_exec_policy(t, config, role):
+def make_session_table(t, config):
+    """
+    Create the DynamoDB table for server-side sessions, if configured.
+    Sessions expire through DynamoDB TTL on the `expires` attribute.
+    """
+    if not config.get("sessions", {}).get("dynamodb", False):
+        return None
+    table = dynamodb.Table(
+        "SessionTable",
+        AttributeDefinitions=[
+            dynamodb.AttributeDefinition(AttributeName="id", AttributeType="S"),
+        ],
+        KeySchema=[
+            dynamodb.KeySchema(AttributeName="id", KeyType="HASH"),
+        ],
+        BillingMode="PAY_PER_REQUEST",
+        TimeToLiveSpecification=dynamodb.TimeToLiveSpecification(
+            AttributeName="expires", Enabled=True
+        ),
+    )
+    t.add_resource(table)
+    t.add_output(
+        Output(
+            "SessionTableName",
+            Description="Value for the `SESSION_TABLE` environment variable.",
+            Value=Ref(table),
+        )
+    )
+    return table
+
+
+def make_lambda_exec_policy(t, config, role, session_table=None):
     """
     Make policies that grant Lambda exec privs.
     """
@@ -189,6 +196,19 @@ def make_lambda_exec_policy(t, config, role):
     bucket_resource = get_bucket_policy_resource(config)
     secrets = config["secrets"]
     secret_arns = list(secrets.values())
+    statements = []
+    if session_table is not None:
+        statements.append(
+            Statement(
+                Effect=Allow,
+                Action=[
+                    Action("dynamodb", "GetItem"),
+                    Action("dynamodb", "PutItem"),
+                    Action("dynamodb", "DeleteItem"),
+                ],
+                Resource=[GetAtt(session_table, "Arn")],
+            )
+        )
     policy = ManagedPolicy(
         "LambdaExecPolicy",
         PolicyDocument=PolicyDocument(
@@ -220,8 +240,11 @@ def make_lambda_exec_policy(t, config, role):
                 Statement(
                     Effect=Allow,
                     Action=[
+                        Action("s3", "GetObject"),
                         Action("s3", "PutObject"),
                         Action("s3", "DeleteObject"),
+                        Action("s3", "AbortMultipartUpload"),
+                        Action("s3", "ListMultipartUploadParts"),
                     ],
                     Resource=[bucket_resource],
                 ),
@@ -232,7 +255,8 @@ def make_lambda_exec_policy(t, config, role):
                     ],
                     Resource=secret_arns,
                 ),
-            ],
+            ]
+            + statements,
         ),
         Roles=[Ref(role)],
     )
@@ -299,23 +323,86 @@ def create_log_alarm(t, config, alarm_name, alarm_cfg, topic):
     return alarm
 
 
+def create_latency_alarms(t, config, topic):
+    """
+    Create latency alarms on the request timing metrics the application
+    logs in Embedded Metric Format (see `applib.timing`).
+    """
+    alarms_cfg = config.get("latency_alarms", {})
+    for alarm_name, alarm_cfg in alarms_cfg.items():
+        create_latency_alarm(t, config, alarm_name, alarm_cfg, topic)
+
+
+def create_latency_alarm(t, config, alarm_name, alarm_cfg, topic):
+    """
+    Create a metric filter that extracts the duration of a request phase of
+    an endpoint from the application logs, and an alarm on its percentile
+    (p99 unless `extended_statistic` is set).
+    """
+    logical_name = "{}LatencyAlarm".format(snake2camel(alarm_name))
+    kwargs = {"ExtendedStatistic": "p99"}
+    for key, value in alarm_cfg.items():
+        if key in {"log_group", "endpoint", "phase"}:
+            continue
+        kwargs[snake2camel(key)] = value
+    metric_namespace = alarm_cfg.get("namespace")
+    assert metric_namespace is not None, Exception(
+        "Latency alarm `{}` requires a `namespace`.".format(alarm_name)
+    )
+    log_group = alarm_cfg.get("log_group")
+    assert log_group is not None, Exception(
+        "Latency alarm `{}` requires a `log_group`.".format(alarm_name)
+    )
+    endpoint = alarm_cfg.get("endpoint")
+    assert endpoint is not None, Exception(
+        "Latency alarm `{}` requires an `endpoint`.".format(alarm_name)
+    )
+    phase = alarm_cfg.get("phase", "total")
+    filter_pattern = '{{ ($.Endpoint = "{}") && ($.{} = *) }}'.format(endpoint, phase)
+    metric_filter = create_metric_filter(
+        t,
+        config,
+        "{}_latency".format(alarm_name),
+        log_group,
+        filter_pattern,
+        metric_namespace,
+        metric_value="$.{}".format(phase),
+        unit="Milliseconds",
+    )
+    kwargs["MetricName"] = metric_filter.MetricTransformations[0].MetricName
+    alarm = cw.Alarm(logical_name, AlarmActions=[Ref(topic)], **kwargs)
+    t.add_resource(alarm)
+    return alarm
+
+
 def create_metric_filter(
-    t, config, filter_name, log_group, filter_pattern, metric_namespace
+    t,
+    config,
+    filter_name,
+    log_group,
+    filter_pattern,
+    metric_namespace,
+    metric_value="1",
+    unit=None,
 ):
     """
     Create a metric filter.
     """
     logical_name = "{}MetricFilter".format(snake2camel(filter_name))
     metric_name = "{}Metric".format(snake2camel(filter_name))
+    transformation_kwargs = {}
+    if unit is not None:
+        transformation_kwargs["Unit"] = unit
     metric_filter = cwlogs.MetricFilter(
         logical_name,
         FilterPattern=filter_pattern,
         LogGroupName=log_group,
         MetricTransformations=[
             cwlogs.MetricTransformation(
-                MetricValue="1",
+                MetricValue=metric_value,
                 MetricNamespace=metric_namespace,
                 MetricName=metric_name,
+                **transformation_kwargs
             )
         ],
     )
@@ -331,11 +418,12 @@ def create_resources(t, config, params, bootstrap=False):
     role = make_lambda_exec_role(t)
     assumed_role = make_s3_assumed_role(t, role)
     make_s3_upload_policy(t, config, assumed_role)
-    make_s3_download_policy(t, config, assumed_role)
-    make_lambda_exec_policy(t, config, role)
+    session_table = make_session_table(t, config)
+    make_lambda_exec_policy(t, config, role, session_table=session_table)
     if not bootstrap:
         alarm_topic = create_sns_topic(t, config, "s3browser_alarms_topic")
         create_log_alarms(t, config, alarm_topic)
+        create_latency_alarms(t, config, alarm_topic)
 
 
 def create_outputs(t, resources):
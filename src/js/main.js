@@ -1,67 +1,162 @@
 
 var $ = require( "jquery" );
 
-// import { S3Client, GetObjectCommand } from "@aws-sdk/client-s3"; // ES Modules import
-const { S3Client, GetObjectCommand, PutObjectCommand } = require("@aws-sdk/client-s3"); // CommonJS import
+// import { S3Client, PutObjectCommand } from "@aws-sdk/client-s3"; // ES Modules import
+const { S3Client, PutObjectCommand } = require("@aws-sdk/client-s3"); // CommonJS import
 
-const streamSaver = require('streamsaver')
+// Downloads use a short-lived presigned URL issued by the app.  Small files
+// are left to the browser's own download manager; larger ones come with a
+// range plan and are fetched as parallel byte ranges, then saved as one file.
+const DOWNLOAD_CONCURRENCY = 4;
+const DOWNLOAD_RANGE_RETRIES = 3;
 
-async function downloadFromS3(bucketName, key, credentials) {
-  const parts = key.split("/")
-  const filename = parts[parts.length - 1]
-  // StreamSaver can detect and use the Ponyfill that is loaded from the cdn.
-  streamSaver.WritableStream = streamSaver.WritableStream
-
-  const REGION = "us-east-1"; //e.g., 'us-east-1'
-  const config = {
-    region: REGION,
-    credentials: credentials}
-
-  const s3 = new S3Client(config);
-  const bucketParams = {
-    Bucket: bucketName,
-    Key: key,
-  }
-
-  const client = new S3Client(config);
-  const command = new GetObjectCommand(bucketParams);
-  async function getDownloadResponse(){
+async function downloadRange(plan, range) {
+  var lastError = null;
+  for(var attempt = 0; attempt < DOWNLOAD_RANGE_RETRIES; attempt++) {
     try {
-      return await client.send(command);
+      const headers = {'Range': "bytes=" + range.start + "-" + range.end};
+      if(plan.etag) {
+        // Fail rather than mix parts of two versions of the object.
+        headers['If-Match'] = plan.etag;
+      }
+      const response = await fetch(plan.url, {headers: headers});
+      if(response.status == 206) {
+        return await response.blob();
+      }
+      lastError = new Error("Range download failed: " + response.status);
+      if(response.status == 412) {
+        break;
+      }
+    }
+    catch(err) {
+      lastError = err;
     }
-    catch(error) {
-      console.log(error);
-      return null;
+  }
+  throw lastError;
+}
+
+async function rangedDownload(plan) {
+  const parts = new Array(plan.ranges.length);
+  var next = 0;
+  async function worker() {
+    while(next < plan.ranges.length) {
+      const index = next++;
+      parts[index] = await downloadRange(plan, plan.ranges[index]);
     }
   }
-  const response = await getDownloadResponse();
-  if(response == null){
+  const workers = [];
+  for(var w = 0; w < DOWNLOAD_CONCURRENCY; w++) {
+    workers.push(worker());
+  }
+  await Promise.all(workers);
+  const link = document.createElement("a");
+  link.href = URL.createObjectURL(new Blob(parts));
+  link.download = plan.key.split("/").pop();
+  document.body.appendChild(link);
+  link.click();
+  link.remove();
+  setTimeout(function(){ URL.revokeObjectURL(link.href); }, 60000);
+}
+
+async function downloadFromS3(key) {
+  var url = new URL(downloadUrl, location);
+  url.searchParams.set("key", key);
+  const response = await fetch(url, {credentials: 'same-origin'});
+  if(!response.ok) {
+    console.log(response);
     alert("Permission error downloading file.");
     return;
   }
-  const contentType = response.Body.contentType
+  const plan = await response.json();
+  if(plan.ranges.length > 0) {
+    try {
+      await rangedDownload(plan);
+      return;
+    }
+    catch(err) {
+      // Fall back to a single request, e.g. if the bucket CORS
+      // configuration does not allow range requests.
+      console.log(err);
+    }
+  }
+  window.location.assign(plan.url);
+}
 
-  // streamSaver.createWriteStream() returns a writable byte stream
-  // The WritableStream only accepts Uint8Array chunks
-  // (no other typed arrays, arrayBuffers or strings are allowed)
-  const fileStream = streamSaver.createWriteStream(filename)
-  const readableStream = response.Body
+// Files larger than this are uploaded in parts through server-issued
+// multipart upload sessions.
+const MULTIPART_THRESHOLD = 16 * 1024 * 1024;
+const UPLOAD_CONCURRENCY = 4;
+const UPLOAD_PART_RETRIES = 3;
 
-  // more optimized
-  if (window.WritableStream && readableStream.pipeTo) {
-    return readableStream.pipeTo(fileStream)
-      .then(() => console.log('done writing'))
+async function postJSON(url, body) {
+  const response = await fetch(url, {
+    method: "POST",
+    credentials: 'same-origin',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': csrf_token,
+    },
+    body: JSON.stringify(body),
+  });
+  if(!response.ok) {
+    throw new Error("Request to " + url + " failed: " + response.status);
   }
+  return response.json();
+}
 
-  window.writer = fileStream.getWriter()
-
-  const reader = response.body.getReader()
-  const pump = () => reader.read()
-    .then(res => res.done
-      ? writer.close()
-      : writer.write(res.value).then(pump))
+async function uploadPart(url, blob) {
+  var lastError = null;
+  for(var attempt = 0; attempt < UPLOAD_PART_RETRIES; attempt++) {
+    try {
+      const response = await fetch(url, {method: "PUT", body: blob});
+      if(response.ok) {
+        return;
+      }
+      lastError = new Error("Part upload failed: " + response.status);
+    }
+    catch(err) {
+      lastError = err;
+    }
+  }
+  throw lastError;
+}
 
-  pump()
+async function multipartUpload(file, fileKey) {
+  const upload = await postJSON(uploadUrls.create, {key: fileKey, size: file.size});
+  const session = {key: fileKey, upload_id: upload.upload_id};
+  const partNumbers = [];
+  for(var n = 1; n <= upload.part_count; n++) {
+    partNumbers.push(n);
+  }
+  try {
+    // Sign and upload the parts in groups; only failed parts are retried.
+    const groupSize = 100;
+    for(var start = 0; start < partNumbers.length; start += groupSize) {
+      const group = partNumbers.slice(start, start + groupSize);
+      const signed = await postJSON(uploadUrls.sign, Object.assign({part_numbers: group}, session));
+      var next = 0;
+      async function worker() {
+        while(next < group.length) {
+          const partNumber = group[next++];
+          const offset = (partNumber - 1) * upload.part_size;
+          const blob = file.slice(offset, offset + upload.part_size);
+          await uploadPart(signed.urls[String(partNumber)], blob);
+        }
+      }
+      const workers = [];
+      for(var w = 0; w < UPLOAD_CONCURRENCY; w++) {
+        workers.push(worker());
+      }
+      await Promise.all(workers);
+    }
+    await postJSON(uploadUrls.complete, session);
+  }
+  catch(err) {
+    await postJSON(uploadUrls.abort, session).catch(function(abortErr){
+      console.log(abortErr);
+    });
+    throw err;
+  }
 }
 
 async function uploadFileHandler(bucketName) {
@@ -80,6 +175,19 @@ async function uploadFileHandler(bucketName) {
     fileKey = fileName;
   }
 
+  if(file.size > MULTIPART_THRESHOLD) {
+    try {
+      await multipartUpload(file, fileKey);
+      alert("Successfully uploaded file.");
+      location.reload();
+    }
+    catch (err) {
+      console.log(err)
+      return alert("There was an error uploading your file: " + err.message);
+    }
+    return;
+  }
+
   const REGION = "us-east-1"; //e.g., 'us-east-1'
   const config = {
     region: REGION,
@@ -94,6 +202,10 @@ async function uploadFileHandler(bucketName) {
 
   try {
     const data = await s3.send(new PutObjectCommand(uploadParams));
+    // Let the app refresh its cached listing of this folder.
+    await postJSON(uploadUrls.uploaded, {key: fileKey}).catch(function(notifyErr){
+      console.log(notifyErr);
+    });
     alert("Successfully uploaded file.");
     location.reload();
   }
@@ -104,7 +216,7 @@ async function uploadFileHandler(bucketName) {
 }
 
 
-function deleteFromS3(key) {
+function deleteFromS3(key, recursive) {
   var path = location.pathname;
   if(path != "" && !path.endsWith("/")) {
     path = path + "/";
@@ -112,6 +224,9 @@ function deleteFromS3(key) {
   path = path + key;
   var url = new URL(location);
   url.pathname = path;
+  if(recursive) {
+    url.searchParams.set("recursive", "true");
+  }
   console.log(url);
   fetch(url, {
     method: "DELETE",
@@ -119,11 +234,19 @@ function deleteFromS3(key) {
     headers: {
       'X-CSRFToken': csrf_token,
     },
-  }).then(function(data){
+  }).then(async function(data){
       if(data.status < 200 || data.status > 299) {
         console.log(data)
         alert("Could not delete object.");
       }
+      else if(recursive) {
+        var report = await data.json();
+        if(report.errors.length > 0) {
+          console.log(report.errors);
+          alert("Deleted " + report.deleted + " objects; " + report.errors.length + " could not be deleted.");
+        }
+        location.reload();
+      }
       else {
         location.reload();
       }
@@ -191,11 +314,10 @@ function setEventHandlers() {
 }
 
 export function setFileEventHandlers() {
-  var bucketName = $("#bucket").data("bucket");
   $("a[data-btnType='download']").off("click").click(async function(event){
     event.preventDefault();
     var key = $( this ).data("key");
-    await downloadFromS3(bucketName, key, credentials);
+    await downloadFromS3(key);
   }).each(function(){
     var key = $( this ).data("key");
     console.log("Set download button event handler for key: " + key);
@@ -203,7 +325,14 @@ export function setFileEventHandlers() {
   $("a[data-btnType='delete']").off("click").click(async function(event){
     event.preventDefault();
     var key = $( this ).data("key");
-    await deleteFromS3(key);
+    var recursive = false;
+    if(key.endsWith("/") && $("#listing").data("allow-remove-file")) {
+      if(!confirm("Delete folder '" + key + "' and everything in it?")) {
+        return;
+      }
+      recursive = true;
+    }
+    await deleteFromS3(key, recursive);
   }).each(function(){
     var key = $( this ).data("key");
     console.log("Set delete button event handler for key: " + key);
@@ -212,6 +341,5 @@ export function setFileEventHandlers() {
 
 $(document).ready(function(){
   configureApp();
-  streamSaver.mitm = window.mitm;
   setEventHandlers();
 });
@@ -1,6 +1,171 @@
 
+function escapeHtml(text) {
+  return $("<div>").text(text).html();
+}
+
+function makeFolderRow(listing, item) {
+  var key = escapeHtml(item.key);
+  var actions = "";
+  if (listing.data("allow-remove-folder")) {
+    actions = '<a class="btn btn-primary" href="#" role="button" data-btnType="delete" data-key="' + key + '" title="Delete folder."><i class="fa fa-trash" aria-hidden="true"></i></a>';
+  }
+  var href = escapeHtml(listing.data("folder-base") + item.key);
+  var size = escapeHtml(String(item.size));
+  if (item.objects !== undefined) {
+    size = '<span title="' + escapeHtml(String(item.objects)) + ' files">' + size + '</span>';
+  }
+  return [
+    '<a href="' + href + '">' + key + '</a>',
+    size,
+    escapeHtml(item.last_modified),
+    actions,
+  ];
+}
+
+function makeFileRow(listing, item) {
+  var key = escapeHtml(item.key);
+  var bucketPath = String(listing.data("bucket-path"));
+  var fullKey = bucketPath == "" ? item.key : bucketPath + "/" + item.key;
+  var actions = "";
+  if (listing.data("allow-download-file")) {
+    actions += '<a class="btn btn-primary" href="#" role="button" data-btnType="download" data-key="' + escapeHtml(fullKey) + '" title="Download file."><i class="fa fa-download" aria-hidden="true"></i></a>\n';
+  }
+  if (listing.data("allow-remove-file")) {
+    actions += '<a class="btn btn-primary" href="#" role="button" data-btnType="delete" data-key="' + key + '" title="Delete file."><i class="fa fa-trash" aria-hidden="true"></i></a>';
+  }
+  return [
+    key,
+    escapeHtml(String(item.size)),
+    escapeHtml(item.last_modified),
+    actions,
+  ];
+}
+
+// Fetch the remaining listing pages and append their rows to the tables.
+async function loadRemainingPages(filesTable, foldersTable) {
+  var listing = $("#listing");
+  var cursor = listing.data("cursor");
+  while (cursor) {
+    var url = new URL(listing.data("listing-url"), location);
+    url.searchParams.set("cursor", cursor);
+    var response = await fetch(url, {credentials: "same-origin"});
+    if (!response.ok) {
+      console.log("Could not load listing page: " + response.status);
+      return;
+    }
+    var page = await response.json();
+    filesTable.rows.add(page.files.map(function(item){
+      return makeFileRow(listing, item);
+    })).draw(false);
+    foldersTable.rows.add(page.folders.map(function(item){
+      return makeFolderRow(listing, item);
+    })).draw(false);
+    S3BLibrary.setFileEventHandlers();
+    cursor = page.cursor;
+  }
+}
+
+// Stream search results (newline-delimited JSON) into the results table.
+async function runSearch(searchTable, query) {
+  var listing = $("#listing");
+  var status = $("#searchStatus");
+  var url = new URL(listing.data("search-url"), location);
+  url.searchParams.set("q", query);
+  searchTable.clear().draw();
+  $("#searchResults").show();
+  status.text("Searching ...");
+  var response = await fetch(url, {credentials: "same-origin"});
+  if (!response.ok) {
+    status.text("Search failed: " + response.status);
+    return;
+  }
+  var reader = response.body.getReader();
+  var decoder = new TextDecoder();
+  var buffered = "";
+  while (true) {
+    var chunk = await reader.read();
+    if (chunk.done) {
+      break;
+    }
+    buffered += decoder.decode(chunk.value, {stream: true});
+    var lines = buffered.split("\n");
+    buffered = lines.pop();
+    var rows = [];
+    lines.forEach(function(line) {
+      if (line == "") {
+        return;
+      }
+      var result = JSON.parse(line);
+      if (result.done) {
+        var text = result.results + " found";
+        if (result.truncated == "limit") {
+          text += " (showing the first " + result.results + ")";
+        }
+        else if (result.truncated == "time") {
+          text += " (search stopped after the time limit)";
+        }
+        status.text(text);
+        return;
+      }
+      rows.push(makeFileRow(listing, result));
+    });
+    if (rows.length) {
+      searchTable.rows.add(rows).draw(false);
+      S3BLibrary.setFileEventHandlers();
+    }
+  }
+}
+
+// Fetch a page of a server-side table.  The slim jQuery build has no
+// `$.ajax`, so DataTables gets its data through `fetch`.
+async function fetchTablePage(listing, kind, makeRow, data, callback) {
+  var url = new URL(listing.data(kind + "-table-url"), location);
+  url.searchParams.set("draw", data.draw);
+  url.searchParams.set("start", data.start);
+  url.searchParams.set("length", data.length);
+  url.searchParams.set("search[value]", data.search.value);
+  if (data.order.length) {
+    url.searchParams.set("order[0][column]", data.order[0].column);
+    url.searchParams.set("order[0][dir]", data.order[0].dir);
+  }
+  var response = await fetch(url, {credentials: "same-origin"});
+  if (!response.ok) {
+    console.log("Could not load table page: " + response.status);
+    return;
+  }
+  var json = await response.json();
+  json.data = json.data.map(function(item) {
+    return makeRow(listing, item);
+  });
+  callback(json);
+}
+
+// Options for a table whose rows are sorted, filtered and paged by the
+// server, for folders with more than one listing page.
+function serverSideOptions(listing, kind, makeRow) {
+  return {
+    serverSide: true,
+    ajax: function(data, callback) {
+      fetchTablePage(listing, kind, makeRow, data, callback);
+    },
+    columnDefs: [{targets: 3, orderable: false}],
+    searchDelay: 300,
+    drawCallback: function() {
+      S3BLibrary.setFileEventHandlers();
+    },
+  };
+}
+
 $(document).ready(function(){
-  $("#filesTable").DataTable();
+  var listing = $("#listing");
+  var serverSide = Boolean(listing.data("cursor"));
+  var filesOptions = {};
+  var foldersOptions = {};
+  if (serverSide) {
+    filesOptions = serverSideOptions(listing, "files", makeFileRow);
+    foldersOptions = serverSideOptions(listing, "folders", makeFolderRow);
+  }
+  var filesTable = $("#filesTable").DataTable(filesOptions);
   $("#filesTable").on("search.dt", function () {
     window.setTimeout(S3BLibrary.setFileEventHandlers, 500);
   }).on("page.dt", function () {
@@ -8,6 +173,16 @@ $(document).ready(function(){
   }).on("length.dt", function () {
     window.setTimeout(S3BLibrary.setFileEventHandlers, 500);
   });
-  $("#foldersTable").DataTable();
+  var foldersTable = $("#foldersTable").DataTable(foldersOptions);
+  var searchTable = $("#searchTable").DataTable();
+  $("#search-button").click(function(e) {
+    e.preventDefault();
+    var query = $("#searchquery").val().trim();
+    if (query != "") {
+      runSearch(searchTable, query);
+    }
+  });
+  if (!serverSide) {
+    loadRemainingPages(filesTable, foldersTable);
+  }
 });
-